@@ -1,14 +1,18 @@
 import os
 
 from PySide6 import QtWidgets
-from PySide6.QtCore import Qt, QObject
+from PySide6.QtCore import Qt, QObject, QTimer
 from PySide6.QtGui import QIcon
 from PySide6.QtUiTools import QUiLoader
-from PySide6.QtWidgets import QWidget, QMainWindow, QListWidgetItem, QDialog, QMenu, QLabel, QHBoxLayout, QSpacerItem
+from PySide6.QtWidgets import QWidget, QMainWindow, QListWidgetItem, QDialog, QMenu, QLabel, QHBoxLayout, QSpacerItem, \
+    QFileDialog
 
 from dialog import NewItemDialog
 from editor import TextEditor
-from file_system_core import FileSystem as FS, load_from_disk
+from file_system_core import FileSystem as FS, load_from_disk, parse_size
+
+SEARCH_LIMIT = 500  # 搜索结果最多显示的条数
+REAP_INTERVAL = 50  # 回收站增量回收的间隔(毫秒)
 
 
 class FileSystemUI(QObject):
@@ -23,6 +27,7 @@ class FileSystemUI(QObject):
             self.fs = FS()
         self.files = []   # 用于存储当前目录下的文件
         self.dirs = []    # 用于存储当前目录下的文件夹
+        self.search_results = {}  # 搜索结果, 显示的路径 -> 文件或文件夹
         self.text_editor = TextEditor()
         self.text_editor.text_saved.connect(self.save_file)
         self.ui.listWidget.doubleClicked.connect(self.on_double_clicked)
@@ -37,6 +42,13 @@ class FileSystemUI(QObject):
         self.ui.delete_button.clicked.connect(self.delete)
         self.ui.rename_button.clicked.connect(self.rename)
         self.ui.format_button.clicked.connect(self.fformat)
+        self.ui.search_button.clicked.connect(self.search)
+        self.ui.search_line.returnPressed.connect(self.search)
+
+        # 删除只是将文件移入回收站, 由定时器在空闲时分批回收块, 避免删除大目录时界面卡顿
+        self.reap_timer = QTimer(self)
+        self.reap_timer.timeout.connect(self.reap)
+        self.reap_timer.start(REAP_INTERVAL)
 
         self.list()
         self.ui.path_label.setText(self.fs.current_directory.name)
@@ -55,6 +67,9 @@ class FileSystemUI(QObject):
         open_file_action = menu.addAction("打开文件")
         rename_action = menu.addAction("重命名")
         format_action = menu.addAction("格式化")
+        import_action = menu.addAction("导入文件夹")
+        export_action = menu.addAction("导出")
+        quota_action = menu.addAction("设置配额")
 
         # 显示菜单，并等待用户选择
         action = menu.exec(self.ui.listWidget.mapToGlobal(pos))
@@ -74,6 +89,12 @@ class FileSystemUI(QObject):
             self.rename()
         elif action == format_action:
             self.fformat()
+        elif action == import_action:
+            self.import_dialog()
+        elif action == export_action:
+            self.export_dialog()
+        elif action == quota_action:
+            self.quota_dialog()
 
     def new_directory_dialog(self):
         dialog = NewItemDialog(self.ui)
@@ -124,18 +145,26 @@ class FileSystemUI(QObject):
         列出当前目录下的文件和文件夹
         """
         self.ui.listWidget.clear()
+        self.search_results.clear()
 
         for directory in self.fs.current_directory.subdirectories:
             item = QListWidgetItem()
             item.setIcon(QIcon("resources/folder.svg"))
             name_label = QLabel(directory.name+"/")
             num_label = QLabel(str(self.fs.get_dir_item_nums(directory)) + "项")
+            size, count = self.fs.get_dir_usage(directory)
+            usage = str(count) + "个文件  " + self.format_size(size)
+            if directory.quota is not None:
+                usage += " / " + self.format_size(directory.quota)
+            usage_label = QLabel(usage)
             layout = QHBoxLayout()
             widget = QWidget()
             layout.addWidget(name_label)
             spacer = QSpacerItem(40, 5, QtWidgets.QSizePolicy.Policy.Expanding, QtWidgets.QSizePolicy.Policy.Minimum)
             layout.addItem(spacer)
             layout.addWidget(num_label)
+            layout.addItem(QSpacerItem(20, 5, QtWidgets.QSizePolicy.Policy.Expanding, QtWidgets.QSizePolicy.Policy.Minimum))
+            layout.addWidget(usage_label)
             widget.setLayout(layout)
             item.setSizeHint(widget.sizeHint())
             self.ui.listWidget.addItem(item)
@@ -163,17 +192,77 @@ class FileSystemUI(QObject):
             self.ui.listWidget.setItemWidget(item, widget)
             self.files.append(file)
 
+        self.ui.listWidget.repaint()
+        self.update_size_label()
+
+    def update_size_label(self):
         total, used = self.fs.get_total_and_used_space_size()
         self.ui.size_label.setText(
             "已使用空间：" + self.format_size(used) + " / " + self.format_size(total))
+        self.ui.size_label.repaint()
+
+    def reap(self):
+        if self.fs.trash:
+            self.fs.reap()
+            self.update_size_label()
+
+    def search(self):
+        """
+        按名字搜索整个文件系统, 开启内容索引时同时搜索文件内容
+        """
+        text = self.ui.search_line.text().strip()
+        if not text:
+            self.list()
+            return
+        results = self.fs.search(text, SEARCH_LIMIT)
+        if self.fs.content_index is not None:
+            results += self.fs.search_content(text, SEARCH_LIMIT)
 
+        self.ui.listWidget.clear()
+        self.search_results.clear()
+        for path, entry in results:
+            if entry.type == "directory":
+                path += "/"
+            if path in self.search_results:
+                continue
+            self.search_results[path] = entry
+            item = QListWidgetItem()
+            if entry.type == "directory":
+                item.setIcon(QIcon("resources/folder.svg"))
+            else:
+                item.setIcon(QIcon("resources/file.svg"))
+            widget = QWidget()
+            layout = QHBoxLayout()
+            layout.addWidget(QLabel(path))
+            layout.setContentsMargins(0, 0, 0, 0)
+            widget.setLayout(layout)
+            item.setSizeHint(widget.sizeHint())
+            self.ui.listWidget.addItem(item)
+            self.ui.listWidget.setItemWidget(item, widget)
+        self.ui.path_label.setText("搜索结果：" + str(len(self.search_results)) + "项")
         self.ui.listWidget.repaint()
-        self.ui.size_label.repaint()
+
+    def open_search_result(self, entry):
+        directory = entry if entry.type == "directory" else entry.parent
+        self.files.clear()
+        self.dirs.clear()
+        self.fs.change_directory(self.fs.get_path(directory))
+        self.ui.search_line.clear()
+        self.list()
+        self.ui.path_label.setText(self.fs.get_current_path())
+        is_root = self.fs.current_directory.name == "/"
+        self.ui.return_button.setEnabled(not is_root)
+        self.ui.return_root_button.setEnabled(not is_root)
+        if entry.type == "file":
+            self.open_file(entry.name)
 
     def on_double_clicked(self, index):
         item = self.ui.listWidget.itemFromIndex(index)
         widget = self.ui.listWidget.itemWidget(item)
         name = widget.layout().itemAt(0).widget().text()
+        if name in self.search_results:
+            self.open_search_result(self.search_results[name])
+            return
         for file in self.files:
             if file.name == name:
                 self.open_file(name)
@@ -195,7 +284,7 @@ class FileSystemUI(QObject):
         if self.fs.write_file(self.text_editor.file_name,bytearray(text, "utf-8")):
             self.list()
         else:
-            QtWidgets.QMessageBox.warning(self.ui, "错误", "保存失败,空间不足")
+            QtWidgets.QMessageBox.warning(self.ui, "错误", "保存失败,空间不足或超出配额")
         self.fs.save_to_disk("fs.pickle")
 
     def open_directory(self, name):
@@ -286,6 +375,59 @@ class FileSystemUI(QObject):
         self.fs.fformat()
         self.list()
 
+    def import_dialog(self):
+        host_dir = QFileDialog.getExistingDirectory(self.ui, "选择要导入的文件夹")
+        if not host_dir:
+            return
+        result, count = self.fs.import_from_host(host_dir)
+        self.list()
+        if result:
+            self.fs.save_to_disk("fs.pickle")
+            QtWidgets.QMessageBox.information(self.ui, "导入", "已导入" + str(count) + "个文件")
+        else:
+            QtWidgets.QMessageBox.warning(self.ui, "错误", "导入失败,空间不足或超出配额")
+
+    def quota_dialog(self):
+        item = self.ui.listWidget.currentItem()
+        if item is None:
+            return
+        name = self.ui.listWidget.itemWidget(item).layout().itemAt(0).widget().text()
+        if not name.endswith("/") or name in self.search_results:
+            QtWidgets.QMessageBox.warning(self.ui, "错误", "请选择当前目录下的文件夹")
+            return
+        directory = self.fs.current_directory.get_subdirectory(name.rstrip("/"))
+        quota = "" if directory.quota is None else self.format_size(directory.quota).replace(" ", "")
+        dialog = NewItemDialog(self.ui, quota)
+        dialog.setWindowTitle("设置配额")
+        dialog.label.setText("请输入配额(如 10MB)，留空表示不限制：")
+        if dialog.exec() == QDialog.DialogCode.Accepted:
+            text = dialog.get_input_text().strip()
+            quota = parse_size(text) if text else None
+            if text and quota is None:
+                QtWidgets.QMessageBox.warning(self.ui, "错误", "配额格式错误")
+                return
+            self.fs.set_quota(self.fs.get_path(directory), quota)
+            self.list()
+            self.fs.save_to_disk("fs.pickle")
+        else:
+            dialog.close()
+
+    def export_dialog(self):
+        # 导出选中的文件或文件夹, 未选中时导出当前目录
+        path = self.fs.get_current_path()
+        item = self.ui.listWidget.currentItem()
+        if item is not None:
+            name = self.ui.listWidget.itemWidget(item).layout().itemAt(0).widget().text()
+            path = name if name in self.search_results else path.rstrip("/") + "/" + name.rstrip("/")
+        host_dir = QFileDialog.getExistingDirectory(self.ui, "选择导出位置")
+        if not host_dir:
+            return
+        result, count = self.fs.export_to_host(path, host_dir)
+        if result:
+            QtWidgets.QMessageBox.information(self.ui, "导出", "已导出" + str(count) + "个文件")
+        else:
+            QtWidgets.QMessageBox.warning(self.ui, "错误", "导出失败,文件不存在")
+
 def main():
     import sys
     app = QtWidgets.QApplication(sys.argv)
@@ -1,6 +1,21 @@
+import argparse
+import math
 import os
 import pickle
+import shlex
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import groupby
+from operator import attrgetter, itemgetter
+
+from search_index import NameIndex, ContentIndex
+
+BLOCK_SIZE = 1024*4     # 块大小
+IO_WORKERS = 8          # 导入导出时宿主机读写线程数
+REAP_BUDGET = 256       # 回收站每次增量回收的工作量, 每释放一个块或处理一个条目计1
 
 
 class Block:
@@ -39,36 +54,81 @@ class FileSystem:
             self.file_block_nums)    # 位图管理空闲空间，0表示空闲, 1表示已使用
         self.space = [Block() for _ in range(self.file_block_nums)]  # 文件系统整体空间
         self.used_size = 0
+        self.name_index = NameIndex()   # 全局名字索引
+        self.content_index = None       # 可选的文件内容倒排索引, 为None时不建立
+        self.trash = deque()            # 已删除但尚未回收块的文件和目录
+        self.next_ino = 2               # 下一个分配的inode号, 1固定为根目录
+        self.pinned = set()             # 仍有打开句柄的文件, 删除后暂不回收
+
+    def migrate(self):
+        """补全旧版本镜像中缺失的字段
+        """
+        if not hasattr(self, "trash"):
+            self.trash = deque()
+        if not hasattr(self, "next_ino"):
+            self.next_ino = 2
+        # 打开的句柄不会跨进程保留
+        self.pinned = set()
+        if not hasattr(self.root, "mtime"):
+            # 旧镜像中的目录没有时间戳, 以加载时间补齐
+            for directory in self.walk(self.root):
+                directory.ctime = directory.mtime = directory.atime = datetime.now()
+        if not hasattr(self.root, "total_size"):
+            for directory in self.walk(self.root):
+                directory.quota = None
+            self.recompute_usage()
+        if not hasattr(self, "name_index"):
+            self.content_index = None
+            for directory in self.walk(self.root):
+                for file in directory.files:
+                    file.parent = directory
+            self.rebuild_search_index()
 
     def create_file(self, name):
-        for file in self.current_directory.files:
+        directory, name = self.split_path(name)
+        if not name:
+            print("Invalid name")
+            return False
+        if directory is None:
+            print("Directory not found")
+            return False
+        for file in directory.files:
             if file.name == name:
                 print("File already exists")
                 return False
         file = File(name)
-        self.current_directory.add_file(file)
+        directory.add_file(file)
+        self.name_index.add(file)
         return True
 
     def delete_file(self, name):
-        file = self.current_directory.get_file(name)
+        directory, name = self.split_path(name)
+        file = directory.get_file(name) if directory else None
         if file:
-            self.current_directory.remove_file(file, self)
+            directory.remove_file(file, self)
+            self.name_index.remove(file)
             return True
         else:
             print("File not found")
             return False
 
     def read_file(self, name):
-        file = self.current_directory.get_file(name)
+        directory, name = self.split_path(name)
+        file = directory.get_file(name) if directory else None
         if file:
             return file.read(self)
         else:
             return bytearray()
 
     def write_file(self, name, data):
-        file = self.current_directory.get_file(name)
+        directory, name = self.split_path(name)
+        file = directory.get_file(name) if directory else None
         if file:
-            return file.write(data, self)
+            result = file.write(data, self)
+            if self.content_index is not None:
+                # 写入失败时文件可能未被修改(空间或配额不足), 也可能已被清空, 按实际内容更新
+                self.content_index.update(file, data if result else file.read(self))
+            return result
         else:
             return False
 
@@ -76,18 +136,30 @@ class FileSystem:
         return self.current_directory.list_contents()
 
     def change_directory(self, name):
+        """切换当前目录
+        Returns:
+            bool: 目录是否存在
+        """
         if name == "..":
             parent = self.current_directory.parent
             if parent:
                 self.current_directory = parent
-            return
+            return True
+        if "/" in name:
+            directory = self.resolve_path(name)
+            if isinstance(directory, Directory):
+                self.current_directory = directory
+                return True
+            return False
         for dir in self.current_directory.subdirectories:
             if dir.name == name:
                 self.current_directory = dir
-                return
+                return True
         directory = self.find_directory(self.root, name)
         if directory:
             self.current_directory = directory
+            return True
+        return False
 
     def find_directory(self, directory, name):
         if directory.name == name:
@@ -101,28 +173,100 @@ class FileSystem:
         return None
 
     def make_directory(self, name):
-        for dir in self.current_directory.subdirectories:
+        parent, name = self.split_path(name)
+        if not name:
+            print("Invalid name")
+            return False
+        if parent is None:
+            print("Directory not found")
+            return False
+        for dir in parent.subdirectories:
             if dir.name == name:
                 print("Directory already exists")
                 return False
-        directory = Directory(name, self.current_directory)
-        self.current_directory.add_subdirectory(directory)
+        directory = Directory(name, parent)
+        parent.add_subdirectory(directory)
+        self.name_index.add(directory)
         return True
 
     def remove_directory(self, name):
+        if "/" in name:
+            directory = self.resolve_path(name)
+            if isinstance(directory, Directory) and directory.parent:
+                self._unlink_directory(directory)
+                return True
+            print("Directory not found")
+            return False
         for subdirectory in self.current_directory.subdirectories:
             if name == subdirectory.name:
-                self.current_directory.remove_subdirectory(subdirectory, self)
+                self._unlink_directory(subdirectory)
                 return True
         directory = self.find_directory(self.root, name)
-        parent = directory.parent
-        if directory:
-            parent.remove_subdirectory(directory, self)
+        if directory and directory.parent:
+            self._unlink_directory(directory)
             return True
         else:
             print("Directory not found")
             return False
 
+    def _unlink_directory(self, directory):
+        """将目录从目录树中摘下放入回收站, 子树中的块和索引由reap增量回收
+        """
+        directory.parent.remove_subdirectory(directory, self)
+        self.name_index.remove(directory)
+        if self._attached_path(self.current_directory) is None:
+            self.current_directory = self.root
+
+    def reap(self, budget=REAP_BUDGET):
+        """增量回收回收站中的块, 每次最多做budget个单位的工作, budget为None时全部回收
+        每释放一个块计1, 没有块的文件, 展开的目录和跳过的条目也至少计1,
+        这样删除大量空文件时单次调用的耗时同样有上限(每个条目还要从名字索引中删除)
+        仍有打开句柄的文件(pinned)会被跳过, 留在回收站中等句柄关闭后再回收
+        Returns:
+            bool: 回收站中是否已没有可回收的条目
+        """
+        deferred = []
+        while self.trash and (budget is None or budget > 0):
+            entry = self.trash[0]
+            cost = 1
+            if entry in self.pinned:
+                deferred.append(self.trash.popleft())
+            elif entry.type == "directory":
+                self.trash.popleft()
+                self.name_index.remove(entry)
+                # 子项的parent在各自被回收时再清除, 展开目录只需在C层复制列表
+                self.trash.extend(entry.files)
+                self.trash.extend(entry.subdirectories)
+                entry.files = []
+                entry.subdirectories = []
+            else:
+                blocks = entry.inode.file_blocks_index
+                count = len(blocks) if budget is None else min(budget, len(blocks))
+                for block_index in blocks[len(blocks) - count:]:
+                    self.valid_blocks[block_index] = 0
+                del blocks[len(blocks) - count:]
+                cost = max(count, 1)
+                if not blocks:
+                    self.trash.popleft()
+                    entry.parent = None
+                    self.used_size -= entry.inode.file_size
+                    entry.inode.file_size = 0
+                    self.unindex(entry)
+            if budget is not None:
+                budget -= cost
+        self.trash.extend(deferred)
+        return len(self.trash) == len(deferred)
+
+    def ensure_free_blocks(self, block_count):
+        """空闲块不足时先从回收站回收, 直到满足block_count个空闲块或回收站清空
+        Returns:
+            bool: 空闲块是否足够
+        """
+        while self.get_valid_block_nums() < block_count:
+            if self.reap():
+                return self.get_valid_block_nums() >= block_count
+        return True
+
     def save_to_disk(self, filename):
         with open(filename, "wb") as f:
             pickle.dump(self, f)
@@ -147,6 +291,37 @@ class FileSystem:
     def get_dir_item_nums(self, directory):
         return len(directory.files) + len(directory.subdirectories)
 
+    def get_dir_usage(self, directory):
+        """获取目录的递归大小和文件数, 由写入和增删时沿父目录链增量维护, 无需遍历
+        Returns:
+            int: 目录下所有文件的总大小
+            int: 目录下所有文件的个数
+        """
+        return directory.total_size, directory.total_files
+
+    def set_quota(self, path, quota):
+        """设置目录的配额(字节), quota为None时取消配额
+        Returns:
+            bool: 是否成功
+        """
+        directory = self.resolve_path(path)
+        if not isinstance(directory, Directory):
+            print("Directory not found")
+            return False
+        directory.quota = quota
+        return True
+
+    def recompute_usage(self, directory=None):
+        """自底向上重新统计directory子树中每个目录的递归大小和文件数
+        """
+        directories = list(self.walk(directory or self.root))
+        for directory in reversed(directories):
+            directory.total_size = sum(file.inode.file_size for file in directory.files)
+            directory.total_files = len(directory.files)
+            for subdirectory in directory.subdirectories:
+                directory.total_size += subdirectory.total_size
+                directory.total_files += subdirectory.total_files
+
     def rename_file(self, old_name, new_name):
         """重命名文件
         Returns:
@@ -163,6 +338,8 @@ class FileSystem:
         file = self.current_directory.get_file(old_name)
         if file:
             file.name = new_name
+            self.name_index.rename(file, old_name)
+            self.current_directory.touch()
             return True, 0
         else:
             return False, 1
@@ -182,29 +359,397 @@ class FileSystem:
         directory = self.current_directory.get_subdirectory(old_name)
         if directory:
             directory.name = new_name
+            self.name_index.rename(directory, old_name)
+            self.current_directory.touch()
             return True, 0
         else:
             return False, 1
 
+    def move(self, old_path, new_path):
+        """移动或重命名文件和目录, 可跨目录; 目标是已存在的文件或空目录时将其替换
+        Returns:
+            bool: 是否成功
+            int: 错误码, 0表示成功, 1表示源或目标所在目录不存在, 3表示目标为非空目录,
+                 4表示新名字为空, 5表示不能将目录移动到自身之下, 6表示超出配额, 7表示目标与源类型不同
+        """
+        entry = self.resolve_path(old_path)
+        new_parent, new_name = self.split_path(new_path)
+        if not new_name:
+            return False, 4
+        if entry is None or entry is self.root or new_parent is None:
+            return False, 1
+        if entry.type == "directory":
+            ancestor = new_parent
+            while ancestor is not None:
+                if ancestor is entry:
+                    return False, 5
+                ancestor = ancestor.parent
+        existing = new_parent.get_file(new_name) or new_parent.get_subdirectory(new_name)
+        if existing is entry:
+            return True, 0
+        if existing is not None:
+            if existing.type != entry.type:
+                return False, 7
+            if existing.type == "directory" and (existing.files or existing.subdirectories):
+                return False, 3
+
+        old_parent, old_name = entry.parent, entry.name
+        size, count = (entry.inode.file_size, 1) if entry.type == "file" else (entry.total_size, entry.total_files)
+        if entry.type == "file":
+            old_parent.files.remove(entry)
+        else:
+            old_parent.subdirectories.remove(entry)
+        old_parent.update_usage(-size, -count)
+        # 被替换的文件随之移入回收站, 配额只按净增量检查
+        replaced = existing.inode.file_size if existing is not None and existing.type == "file" else 0
+        if not new_parent.check_quota(size - replaced):
+            # 超出配额时放回原目录
+            if entry.type == "file":
+                old_parent.add_file(entry)
+            else:
+                old_parent.add_subdirectory(entry)
+            return False, 6
+
+        if existing is not None:
+            if existing.type == "file":
+                new_parent.remove_file(existing, self)
+            else:
+                new_parent.remove_subdirectory(existing, self)
+            self.name_index.remove(existing)
+        entry.name = new_name
+        self.name_index.rename(entry, old_name)
+        old_parent.touch()
+        if entry.type == "file":
+            new_parent.add_file(entry)
+        else:
+            new_parent.add_subdirectory(entry)
+        if self._attached_path(self.current_directory) is None:
+            # 被替换的空目录正是当前目录
+            self.current_directory = self.root
+        return True, 0
+
+    def get_ino(self, entry):
+        """获取文件或目录的inode号, 首次访问时分配, 之后随镜像保存保持不变
+        """
+        if entry is self.root:
+            return 1
+        ino = getattr(entry, "ino", None)
+        if ino is None:
+            ino = entry.ino = self.next_ino
+            self.next_ino += 1
+        return ino
+
+    def refresh_content_index(self, file):
+        """按文件当前内容更新内容索引, 用于按范围写入后统一刷新
+        """
+        if self.content_index is not None:
+            self.content_index.update(file, file.read(self))
+
     def fformat(self):
-        for file in self.root.files:
-            self.root.remove_file(file, self)
-        self.root.remove_all_subdirectories(self)
+        """格式化: 直接重建位图和根目录, 旧目录树随对象一起丢弃, 无需逐个释放块
+        """
+        self.root = Directory("/", None)
+        self.current_directory = self.root
+        self.valid_blocks = bytearray(self.file_block_nums)
+        self.used_size = 0
+        self.trash = deque()
+        self.next_ino = 2
+        self.rebuild_search_index()
 
     def get_total_and_used_space_size(self):
         return self.file_block_nums*1024*4, self.used_size
 
     def get_valid_block_nums(self) -> int:
-        result = 0
-        for block in self.valid_blocks:
-            if block == 0:
-                result += 1
-        return result
+        return self.valid_blocks.count(0)
+
+    def allocate_block(self) -> int:
+        """在位图中找到一个空闲块并标记为已使用
+        Returns:
+            int: 块号, 没有空闲块时为-1
+        """
+        index = self.valid_blocks.find(0)
+        if index != -1:
+            self.valid_blocks[index] = 1
+        return index
+
+    def import_from_host(self, host_dir, workers=IO_WORKERS):
+        """将宿主机目录host_dir整体导入为当前目录下的同名子目录, 同名文件会被覆盖
+        宿主机文件由线程池按块读取, 读到的块直接写入空闲块, 目录和统计信息在最后统一更新
+        Returns:
+            bool: 是否成功
+            int: 导入的文件数
+        """
+        host_dir = os.path.abspath(host_dir)
+        if not os.path.isdir(host_dir):
+            print("Host directory not found")
+            return False, 0
+
+        # 先扫描宿主机目录, 确认配额和空间足够后再修改文件系统
+        root_name = os.path.basename(host_dir)
+        plan = []   # [(目标目录各级名字, [(文件名, 宿主机路径)])]
+        targets = {(): self.current_directory}  # 目标目录各级名字 -> 已存在的目录, 尚不存在时为None
+        deltas = {}     # 目标目录各级名字 -> 导入后该子树大小的变化, 被覆盖的文件按差值计
+        block_count = 0
+        for dirpath, dirnames, filenames in os.walk(host_dir):
+            dirnames.sort()
+            relpath = os.path.relpath(dirpath, host_dir)
+            parts = (root_name,) if relpath == "." else (root_name,) + tuple(relpath.split(os.sep))
+            parent = targets[parts[:-1]]
+            target = targets[parts] = parent.get_subdirectory(parts[-1]) if parent else None
+            sizes = {file.name: file.inode.file_size for file in target.files} if target else {}
+            delta = 0
+            entries = []
+            for filename in sorted(filenames):
+                host_path = os.path.join(dirpath, filename)
+                if not os.path.isfile(host_path):
+                    continue
+                size = os.path.getsize(host_path)
+                block_count += -(-size // BLOCK_SIZE)
+                delta += size - sizes.get(filename, 0)
+                entries.append((filename, host_path))
+            for depth in range(len(parts) + 1):
+                deltas[parts[:depth]] = deltas.get(parts[:depth], 0) + delta
+            plan.append((parts, entries))
+        # 当前目录及其祖先, 以及导入目标中已存在的每个目录都可能设有配额
+        for parts, directory in targets.items():
+            if directory is not None and not directory.check_quota(deltas[parts]):
+                print("Quota exceeded")
+                return False, 0
+        if not self.ensure_free_blocks(block_count):
+            print("No more space available")
+            return False, 0
+
+        jobs = []   # [(目标目录, 文件名, 宿主机路径)]
+        existing = {}   # 目标目录 -> {文件名: 文件}, 避免每个文件都线性查找
+        for parts, entries in plan:
+            directory = self.current_directory
+            for part in parts:
+                subdirectory = directory.get_subdirectory(part)
+                if subdirectory is None:
+                    subdirectory = Directory(part, directory)
+                    directory.add_subdirectory(subdirectory)
+                    self.name_index.add(subdirectory)
+                directory = subdirectory
+            if directory not in existing:
+                existing[directory] = {file.name: file for file in directory.files}
+            for filename, host_path in entries:
+                jobs.append((directory, filename, host_path))
+
+        now = datetime.now()
+        imported_size = 0
+        imported = 0
+        added = []  # 新建的文件, 最后统一加入名字索引
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # 限制同时在内存中的文件数, 避免一次性读入全部内容
+                window = workers * 4
+                for start in range(0, len(jobs), window):
+                    batch = jobs[start:start + window]
+                    futures = [executor.submit(_read_host_file, host_path)
+                               for _, _, host_path in batch]
+                    for (directory, filename, _), future in zip(batch, futures):
+                        chunks = future.result()
+                        file = existing[directory].get(filename)
+                        if file is None:
+                            file = File(filename)
+                            directory.add_file(file)
+                            added.append(file)
+                        else:
+                            file.clear(self)
+                        file.inode.ctime = file.inode.mtime = file.inode.atime = now
+                        for chunk in chunks:
+                            block_index = self.allocate_block()
+                            if block_index == -1:
+                                print("No more space available")
+                                directory.update_usage(file.inode.file_size, 0)
+                                return False, imported
+                            self.space[block_index].write(chunk)
+                            file.inode.add_block(block_index)
+                            file.inode.file_size += len(chunk)
+                            imported_size += len(chunk)
+                        directory.update_usage(file.inode.file_size, 0)
+                        if self.content_index is not None:
+                            self.content_index.update(file, b"".join(chunks))
+                        imported += 1
+        finally:
+            # 宿主机读取出错中途退出时, 已写入的文件也要计入已用空间和名字索引
+            self.used_size += imported_size
+            self.name_index.extend(added)
+        return True, imported
+
+    def export_to_host(self, path, host_dir, workers=IO_WORKERS):
+        """将文件系统中path对应的文件或目录导出到宿主机目录host_dir下, 导出根目录时直接导出其内容
+        Returns:
+            bool: 是否成功
+            int: 导出的文件数
+        """
+        entry = self.resolve_path(path)
+        if entry is None:
+            print("File or directory not found")
+            return False, 0
+        os.makedirs(host_dir, exist_ok=True)
+
+        exported = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            if entry.type == "file":
+                futures.append(executor.submit(
+                    _write_host_file, os.path.join(host_dir, entry.name), entry.read(self)))
+            else:
+                stack = [(entry, host_dir if entry is self.root else os.path.join(host_dir, entry.name))]
+                while stack:
+                    directory, target = stack.pop()
+                    os.makedirs(target, exist_ok=True)
+                    for file in directory.files:
+                        futures.append(executor.submit(
+                            _write_host_file, os.path.join(target, file.name), file.read(self)))
+                    for subdirectory in directory.subdirectories:
+                        stack.append((subdirectory, os.path.join(target, subdirectory.name)))
+            for future in futures:
+                future.result()
+                exported += 1
+        return True, exported
+
+    def walk(self, directory):
+        """迭代遍历directory及其所有子目录
+        """
+        stack = [directory]
+        while stack:
+            directory = stack.pop()
+            yield directory
+            stack.extend(directory.subdirectories)
+
+    def _attached_path(self, entry):
+        """获取条目的绝对路径, 条目已被删除(不在目录树中)时返回None
+        """
+        path = ""
+        while entry is not self.root:
+            if entry is None:
+                return None
+            path = "/" + entry.name + path
+            entry = entry.parent
+        return path or "/"
+
+    def get_path(self, entry):
+        """获取文件或目录的绝对路径
+        """
+        if entry is self.root:
+            return "/"
+        path = ""
+        while entry is not None and entry is not self.root:
+            path = "/" + entry.name + path
+            entry = entry.parent
+        return path
+
+    def resolve_path(self, path):
+        """按路径查找文件或目录, 以"/"开头时从根目录开始, 否则从当前目录开始
+        Returns:
+            File | Directory | None: 找到的文件或目录, 不存在时为None
+        """
+        entry = self.root if path.startswith("/") else self.current_directory
+        for part in path.split("/"):
+            if part == "" or part == ".":
+                continue
+            if not isinstance(entry, Directory):
+                return None
+            if part == "..":
+                if entry.parent:
+                    entry = entry.parent
+                continue
+            child = entry.get_subdirectory(part)
+            if child is None:
+                child = entry.get_file(part)
+            if child is None:
+                return None
+            entry = child
+        return entry
+
+    def split_path(self, path):
+        """将路径拆分为所在目录和名字, 不含"/"时所在目录为当前目录
+        Returns:
+            Directory | None: 所在目录, 不存在或名字为空时为None
+            str: 名字
+        """
+        stripped = path.rstrip("/")
+        if not stripped or stripped.rsplit("/", 1)[-1] in (".", ".."):
+            return None, ""
+        if "/" not in stripped:
+            return (self.root if path.startswith("/") else self.current_directory), stripped
+        dirname, name = stripped.rsplit("/", 1)
+        directory = self.resolve_path(dirname or "/")
+        if not isinstance(directory, Directory):
+            return None, name
+        return directory, name
+
+    def rebuild_search_index(self):
+        """根据目录树重建名字索引和内容索引
+        """
+        self.name_index = NameIndex()
+        if self.content_index is not None:
+            self.content_index = ContentIndex()
+        entries = []
+        for directory in self.walk(self.root):
+            if directory is not self.root:
+                entries.append(directory)
+            entries.extend(directory.files)
+            if self.content_index is not None:
+                for file in directory.files:
+                    self.content_index.update(file, file.read(self))
+        self.name_index.extend(entries)
+
+    def enable_content_index(self):
+        if self.content_index is None:
+            self.content_index = ContentIndex()
+            for directory in self.walk(self.root):
+                for file in directory.files:
+                    self.content_index.update(file, file.read(self))
+
+    def disable_content_index(self):
+        self.content_index = None
+
+    def unindex(self, file):
+        self.name_index.remove(file)
+        if self.content_index is not None:
+            self.content_index.remove(file)
+
+    def search(self, pattern, limit=None):
+        """按名字搜索文件和目录, pattern含通配符(*?[)时按通配符匹配, 否则按前缀匹配
+        Returns:
+            list: [(路径, 文件或目录)], 按名字排序, 同名时按路径排序
+        """
+        return self._sorted_by_name(self.name_index.search(pattern), limit)
+
+    def search_content(self, query, limit=None):
+        """搜索内容中包含query所有词的文件, 需先调用enable_content_index
+        Returns:
+            list: [(路径, 文件)], 按名字排序, 同名时按路径排序
+        """
+        if self.content_index is None:
+            return []
+        return self._sorted_by_name(sorted(self.content_index.search(query), key=attrgetter("name")), limit)
+
+    def _sorted_by_path(self, entries):
+        # 已删除目录中的条目在被回收前仍留在索引中, 这里将其过滤掉
+        results = ((path, entry) for path, entry in
+                   ((self._attached_path(entry), entry) for entry in entries) if path)
+        return sorted(results, key=itemgetter(0))
+
+    def _sorted_by_name(self, entries, limit):
+        """entries已按名字有序, 逐个名字取出并计算路径, 凑够limit个结果后停止
+        路径需要沿父目录链逐级拼接, 只为最终返回的条目(和最后一组同名条目)计算
+        """
+        results = []
+        for _, group in groupby(entries, key=attrgetter("name")):
+            if limit and len(results) >= limit:
+                break
+            results += self._sorted_by_path(group)
+        return results[:limit] if limit else results
 
 
 class File:
     def __init__(self, name):
         self.name = name
+        self.parent = None
         self.inode = Inode()
         self.type = "file"
 
@@ -215,37 +760,117 @@ class File:
             data += fs.space[block_index].read()
         return data
 
+    def read_range(self, offset: int, size: int, fs: FileSystem) -> bytes:
+        """读取[offset, offset+size)范围的内容, 只访问涉及的块
+        """
+        self.inode.atime = datetime.now()
+        end = min(self.inode.file_size, offset + size)
+        if offset >= end:
+            return b""
+        first = offset // BLOCK_SIZE
+        last = (end - 1) // BLOCK_SIZE
+        blocks = self.inode.file_blocks_index[first:last + 1]
+        data = b"".join(fs.space[block_index].read() for block_index in blocks)
+        return data[offset - first * BLOCK_SIZE:end - first * BLOCK_SIZE]
+
+    def write_range(self, data, offset: int, fs: FileSystem) -> bool:
+        """从offset开始原地写入data, 只修改涉及的块, 超出文件末尾时自动扩展, 中间的空洞补0
+        """
+        if not data:
+            return True
+        end = offset + len(data)
+        if end > self.inode.file_size and not self.resize(end, fs):
+            return False
+        first = offset // BLOCK_SIZE
+        position = offset
+        for block_index in self.inode.file_blocks_index[first:(end - 1) // BLOCK_SIZE + 1]:
+            block = fs.space[block_index]
+            if not isinstance(block.data, bytearray):
+                block.data = bytearray(block.data)
+            start = position % BLOCK_SIZE
+            length = min(BLOCK_SIZE - start, end - position)
+            block.data[start:start + length] = data[position - offset:position - offset + length]
+            position += length
+        self.inode.mtime = datetime.now()
+        return True
+
+    def resize(self, length: int, fs: FileSystem) -> bool:
+        """将文件截断或用0扩展到length字节, 只分配或释放末尾的块
+        """
+        size = self.inode.file_size
+        blocks = self.inode.file_blocks_index
+        if length > size:
+            if self.parent and not self.parent.check_quota(length - size):
+                print("Quota exceeded")
+                return False
+            if not fs.ensure_free_blocks(-(-length // BLOCK_SIZE) - len(blocks)):
+                print("No more space available")
+                return False
+            remaining = length - size
+            if blocks:
+                # 先补满最后一块, 保证除最后一块外都是满块
+                last = fs.space[blocks[-1]]
+                fill = min(BLOCK_SIZE - len(last.data), remaining)
+                if fill > 0:
+                    last.data = bytearray(last.data) + bytearray(fill)
+                    remaining -= fill
+            while remaining > 0:
+                block_index = fs.allocate_block()
+                fs.space[block_index].write(bytearray(min(BLOCK_SIZE, remaining)))
+                self.inode.add_block(block_index)
+                remaining -= min(BLOCK_SIZE, remaining)
+        elif length < size:
+            keep = -(-length // BLOCK_SIZE)
+            for block_index in blocks[keep:]:
+                fs.valid_blocks[block_index] = 0
+            del blocks[keep:]
+            if blocks:
+                last = fs.space[blocks[-1]]
+                last.data = bytearray(last.data[:length - (keep - 1) * BLOCK_SIZE])
+        else:
+            return True
+        fs.used_size += length - size
+        if self.parent:
+            self.parent.update_usage(length - size, 0)
+        self.inode.file_size = length
+        self.inode.mtime = datetime.now()
+        return True
+
     def write(self, data: bytearray, fs: FileSystem) -> bool:
-        valid_block_nums = fs.get_valid_block_nums()
+        if self.parent and not self.parent.check_quota(len(data) - self.inode.file_size):
+            print("Quota exceeded")
+            return False
         block_count = len(data) // (1024*4) + 1
-        if block_count > valid_block_nums:
+        if not fs.ensure_free_blocks(block_count):
             print("No more space available")
             return False
         self.clear(fs)
         self.inode.file_size = len(data)
         fs.used_size += self.inode.file_size
+        if self.parent:
+            self.parent.update_usage(self.inode.file_size, 0)
         for i in range(block_count):
-            j = 0
-            for j in range(fs.file_block_nums):
-                if fs.valid_blocks[j] == 0:
-                    fs.valid_blocks[j] = 1
-                    block = fs.space[j]
-                    if i == 0:
-                        self.inode.mtime = datetime.now()
-                        self.inode.atime = datetime.now()
-                    block.write(
-                        data[i * 1024*4: min((i + 1) * 1024*4, len(data))])
-                    self.inode.add_block(j)
-                    break
-            if j == fs.file_block_nums-1:
+            j = fs.allocate_block()
+            if j == -1:
+                # 释放已分配的块, 避免块泄漏和used_size重复计数
+                self.clear(fs)
                 print("No more space available")
                 return False
+            if i == 0:
+                self.inode.mtime = datetime.now()
+                self.inode.atime = datetime.now()
+            fs.space[j].write(
+                data[i * 1024*4: min((i + 1) * 1024*4, len(data))])
+            self.inode.add_block(j)
         return True
 
     def clear(self, fs: FileSystem):
         """释放文件占用block
         """
         fs.used_size -= self.inode.file_size
+        if self.parent:
+            self.parent.update_usage(-self.inode.file_size, 0)
+        self.inode.file_size = 0
         self.inode.ctime = datetime.now()
         self.inode.mtime = datetime.now()
         self.inode.atime = datetime.now()
@@ -261,13 +886,53 @@ class Directory:
         self.files = []
         self.subdirectories = []
         self.type = "directory"
+        self.total_size = 0     # 子树中所有文件的总大小
+        self.total_files = 0    # 子树中的文件数
+        self.quota = None       # 子树总大小上限, None表示不限制
+        self.ctime = datetime.now()
+        self.mtime = datetime.now()
+        self.atime = datetime.now()
+
+    def touch(self):
+        """目录项增删或改名后更新修改时间
+        """
+        self.mtime = self.ctime = datetime.now()
+
+    def update_usage(self, size_delta, file_delta):
+        """沿父目录链更新递归大小和文件数
+        """
+        directory = self
+        while directory is not None:
+            directory.total_size += size_delta
+            directory.total_files += file_delta
+            directory = directory.parent
+
+    def check_quota(self, size_delta) -> bool:
+        """检查子树增加size_delta字节后是否超出本目录或任一祖先目录的配额
+        """
+        if size_delta <= 0:
+            return True
+        directory = self
+        while directory is not None:
+            if directory.quota is not None and directory.total_size + size_delta > directory.quota:
+                return False
+            directory = directory.parent
+        return True
 
     def add_file(self, file):
+        file.parent = self
         self.files.append(file)
+        self.update_usage(file.inode.file_size, 1)
+        self.touch()
 
     def remove_file(self, file, fs: FileSystem):
-        file.clear(fs)
+        """将文件移入回收站, 占用的块由fs.reap回收
+        """
         self.files.remove(file)
+        self.update_usage(-file.inode.file_size, -1)
+        self.touch()
+        file.parent = None
+        fs.trash.append(file)
 
     def get_file(self, name):
         for file in self.files:
@@ -275,23 +940,20 @@ class Directory:
                 return file
 
     def add_subdirectory(self, directory):
+        directory.parent = self
         self.subdirectories.append(directory)
+        self.update_usage(directory.total_size, directory.total_files)
+        self.touch()
 
     def remove_subdirectory(self, directory, fs: FileSystem):
+        """将子目录整体移入回收站, 其中的文件和块由fs.reap回收
+        """
         if directory in self.subdirectories:
-            for file in directory.files:
-                directory.remove_file(file, fs)
             self.subdirectories.remove(directory)
+            self.update_usage(-directory.total_size, -directory.total_files)
+            self.touch()
             directory.parent = None
-            directory.remove_all_subdirectories(fs)
-
-    def remove_all_subdirectories(self, fs: FileSystem):
-        for directory in self.subdirectories:
-            for file in directory.files:
-                directory.remove_file(file, fs)
-            directory.parent = None
-            directory.remove_all_subdirectories(fs)
-        self.subdirectories = []
+            fs.trash.append(directory)
 
     def get_subdirectory(self, name):
         for directory in self.subdirectories:
@@ -308,101 +970,388 @@ class Directory:
         return dir_contents, file_contents
 
 
+def _read_host_file(host_path):
+    """按块读取宿主机文件
+    """
+    chunks = []
+    with open(host_path, "rb") as f:
+        while True:
+            chunk = f.read(BLOCK_SIZE)
+            if not chunk:
+                break
+            chunks.append(bytearray(chunk))
+    return chunks
+
+
+def _write_host_file(host_path, data):
+    with open(host_path, "wb") as f:
+        f.write(data)
+
+
+class _Unpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        # 直接运行本文件时保存的镜像记录的模块名为__main__
+        if module == "__main__":
+            module = "file_system_core"
+        return super().find_class(module, name)
+
+
 def load_from_disk(filename):
     with open(filename, "rb") as f:
-        return pickle.load(f)
+        fs = _Unpickler(f).load()
+    fs.migrate()
+    return fs
 
 
-if __name__ == '__main__':
-    if os.path.exists("fs.pickle"):
-        fs = load_from_disk("fs.pickle")
+SIZE_UNITS = {"": 1, "B": 1, "K": 1024, "KB": 1024, "M": 1024**2, "MB": 1024**2, "G": 1024**3, "GB": 1024**3}
+
+
+def parse_size(text):
+    """解析形如"4096", "10K", "1.5MB"的大小
+    Returns:
+        int | None: 字节数, 格式错误, 为负数或不是有限值(inf, nan, 1e400)时为None
+    """
+    text = text.strip().upper()
+    number = text.rstrip("KMGB")
+    unit = text[len(number):]
+    if unit not in SIZE_UNITS:
+        return None
+    try:
+        size = float(number) * SIZE_UNITS[unit]
+    except ValueError:
+        return None
+    if not math.isfinite(size) or size < 0:
+        return None
+    return int(size)
+
+
+def print_help():
+    print("Available commands:")
+    print("touch <path> - Create a new file")
+    print("edit <path> <data> - Write text to a file")
+    print("write <path> <host-file>|- - Write a host file or stdin to a file, creating it if needed")
+    print("cat <path> - Read a file")
+    print("read <path> [<host-file>|-] - Copy a file to a host file or stdout")
+    print("rm <path> - Delete a file")
+    print("ls - List files and directories in the current directory")
+    print("cd <path> - Change to a directory")
+    print("mkdir <path> - Create a new directory")
+    print("rmdir <path> - Remove a directory")
+    print("pwd - Print the current working directory")
+    print("find <name_prefix|glob> - Search files and directories by name")
+    print("grep <word> [word ...] - Search files by content")
+    print("index on|off - Enable or disable the content index")
+    print("import <host-dir> - Import a host directory into the current directory")
+    print("export <image-path> <host-dir> - Export a file or directory to the host")
+    print("du [path] - Show the total size and file count of a directory")
+    print("quota <path> <size>|none - Set or clear a directory quota, e.g. 10M")
+    print("fsck [--repair] - Check and optionally repair file system consistency")
+    print("exit - Exit the file system")
+
+
+def execute_command(fs, command_list, stdin=None):
+    """执行一条命令, 宿主机读写和解码出错时只使该命令失败, 不中断整个会话
+    Args:
+        stdin: 二进制输入流, write命令的数据来源为"-"时从中读取, 为None时不可用
+    Returns:
+        bool: 命令是否执行成功
+    """
+    try:
+        return _execute_command(fs, command_list, stdin)
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"{command_list[0]}: {e}\n")
+        return False
+
+
+def _execute_command(fs, command_list, stdin):
+    if command_list[0] == "touch":
+        if len(command_list) < 2:
+            print("Usage: touch <path>")
+            return False
+        if not fs.create_file(command_list[1]):
+            return False
+        print("file created\n")
+    elif command_list[0] == "edit":
+        if len(command_list) < 3:
+            print("Usage: edit <path> <data>")
+            return False
+        if not isinstance(fs.resolve_path(command_list[1]), File):
+            print("File not found\n")
+            return False
+        if not fs.write_file(command_list[1], bytearray(" ".join(command_list[2:]), "utf-8")):
+            # 失败原因(配额或空间不足)已由File.write输出
+            print()
+            return False
+        print("File written\n")
+    elif command_list[0] == "write":
+        if len(command_list) < 3:
+            print("Usage: write <path> <host-file>|-")
+            return False
+        if command_list[2] == "-":
+            if stdin is None:
+                print("stdin is not available\n")
+                return False
+            data = stdin.read()
+        elif os.path.isfile(command_list[2]):
+            with open(command_list[2], "rb") as f:
+                data = f.read()
+        else:
+            print("Host file not found\n")
+            return False
+        created = not isinstance(fs.resolve_path(command_list[1]), File)
+        if created and not fs.create_file(command_list[1]):
+            return False
+        if not fs.write_file(command_list[1], bytearray(data)):
+            if created:
+                # 写入失败时不留下新建的空文件
+                fs.delete_file(command_list[1])
+            print()
+            return False
+        print(f"{len(data)} bytes written\n")
+    elif command_list[0] == "cat":
+        if len(command_list) < 2:
+            print("Usage: cat <path>")
+            return False
+        if not isinstance(fs.resolve_path(command_list[1]), File):
+            print("File not found")
+            print()
+            return False
+        print(fs.read_file(command_list[1]).decode("utf-8", errors="replace"))
+        print()
+    elif command_list[0] == "read":
+        if len(command_list) < 2:
+            print("Usage: read <path> [<host-file>|-]")
+            return False
+        file = fs.resolve_path(command_list[1])
+        if not isinstance(file, File):
+            print("File not found\n")
+            return False
+        data = file.read(fs)
+        if len(command_list) < 3 or command_list[2] == "-":
+            sys.stdout.flush()
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        else:
+            with open(command_list[2], "wb") as f:
+                f.write(data)
+    elif command_list[0] == "rm":
+        if len(command_list) < 2:
+            print("Usage: rm <path>")
+            return False
+        if fs.delete_file(command_list[1]):
+            print("File deleted")
+            print()
+        else:
+            print("File not found")
+            print()
+            return False
+    elif command_list[0] == "ls":
+        dir_content, file_content = fs.list_directory()
+        print(
+            f"Dir:{fs.current_directory.name},Total {len(dir_content)+len(file_content)}\n")
+        print("Directory:")
+        for item in dir_content:
+            print(item.name+"/")
+        print()
+        print("File:")
+        for item in file_content:
+            print(item.name+"\t\t" +
+                  f"{item.inode.file_size} bytes\t\t{item.inode.mtime}")
+        print()
+    elif command_list[0] == "cd":
+        if len(command_list) < 2:
+            print("Usage: cd <path>")
+            return False
+        if not fs.change_directory(command_list[1]):
+            print("Directory not found\n")
+            return False
+    elif command_list[0] == "mkdir":
+        if len(command_list) < 2:
+            print("Usage: mkdir <path>")
+            return False
+        return fs.make_directory(command_list[1])
+    elif command_list[0] == "rmdir":
+        if len(command_list) < 2:
+            print("Usage: rmdir <path>")
+            return False
+        return fs.remove_directory(command_list[1])
+    elif command_list[0] == "find":
+        if len(command_list) < 2:
+            print("Usage: find <name_prefix|glob>")
+            return False
+        for path, entry in fs.search(command_list[1]):
+            print(path + "/" if entry.type == "directory" else path)
+        print()
+    elif command_list[0] == "grep":
+        if len(command_list) < 2:
+            print("Usage: grep <word> [word ...]")
+            return False
+        if fs.content_index is None:
+            print("Content index is off, use 'index on' first\n")
+            return False
+        for path, _ in fs.search_content(" ".join(command_list[1:])):
+            print(path)
+        print()
+    elif command_list[0] == "index":
+        if len(command_list) < 2 or command_list[1] not in ("on", "off"):
+            print("Usage: index on|off")
+            return False
+        if command_list[1] == "on":
+            fs.enable_content_index()
+            print("Content index enabled\n")
+        else:
+            fs.disable_content_index()
+            print("Content index disabled\n")
+    elif command_list[0] == "import":
+        if len(command_list) < 2:
+            print("Usage: import <host-dir>")
+            return False
+        result, count = fs.import_from_host(command_list[1])
+        if not result:
+            return False
+        print(f"{count} files imported\n")
+    elif command_list[0] == "export":
+        if len(command_list) < 3:
+            print("Usage: export <image-path> <host-dir>")
+            return False
+        result, count = fs.export_to_host(command_list[1], command_list[2])
+        if not result:
+            return False
+        print(f"{count} files exported\n")
+    elif command_list[0] == "du":
+        directory = fs.resolve_path(command_list[1]) if len(command_list) > 1 else fs.current_directory
+        if not isinstance(directory, Directory):
+            print("Directory not found\n")
+            return False
+        size, count = fs.get_dir_usage(directory)
+        quota = "none" if directory.quota is None else f"{directory.quota} bytes"
+        print(f"{fs.get_path(directory)}\t{size} bytes\t{count} files\tquota {quota}\n")
+    elif command_list[0] == "quota":
+        if len(command_list) < 3:
+            print("Usage: quota <path> <size>|none")
+            return False
+        if command_list[2] == "none":
+            quota = None
+        else:
+            quota = parse_size(command_list[2])
+            if quota is None:
+                print("Invalid size\n")
+                return False
+        return fs.set_quota(command_list[1], quota)
+    elif command_list[0] == "fsck":
+        from fsck import fsck
+        report = fsck(fs, repair="--repair" in command_list[1:])
+        for line in report.summary():
+            print(line)
+        print()
+        return report.ok() or report.repaired
+    elif command_list[0] == "pwd":
+        print(fs.get_current_path())
+    elif command_list[0] == "help":
+        print_help()
     else:
-        fs = FileSystem()
+        print("Unknown command: ", command_list[0], "Use 'help' for help")
+        return False
+    return True
+
+
+def parse_command(command):
+    """按shell规则拆分命令, 支持引号和#注释
+    Returns:
+        list | None: 拆分后的命令, 格式错误时为None
+    """
+    try:
+        return shlex.split(command, comments=True)
+    except ValueError as e:
+        print("Invalid command:", e)
+        return None
+
+
+def run_interactive(fs, image):
     while True:
         print(f"{fs.current_directory.name}>", end="")
-        command = input()
-        command_list = command.split()
-        if command_list[0] == "touch":
-            if len(command_list) < 2:
-                print("Usage: touch <filename>")
-                continue
-            fs.create_file(command_list[1])
-            print("file created\n")
-        elif command_list[0] == "edit":
-            if len(command_list) < 3:
-                print("Usage: edit <filename> <data>")
-                continue
-            if fs.write_file(command_list[1], bytearray(command_list[2], "utf-8")):
-                print("File written\n")
-            else:
-                print("File not found\n")
-        elif command_list[0] == "cat":
-            if len(command_list) < 2:
-                print("Usage: cat <filename>")
-                continue
-            data = fs.read_file(command_list[1])
-            if data:
-                print(data.decode("utf-8"))
-                print()
-            else:
-                print("File not found")
-                print()
-        elif command_list[0] == "rm":
-            if len(command_list) < 2:
-                print("Usage: rm <filename>")
-                continue
-            if fs.delete_file(command_list[1]):
-                print("File deleted")
-                print()
-            else:
-                print("File not found")
-                print()
-        elif command_list[0] == "ls":
-            dir_content, file_content = fs.list_directory()
-            print(
-                f"Dir:{fs.current_directory.name},Total {len(dir_content)+len(file_content)}\n")
-            print("Directory:")
-            for item in dir_content:
-                print(item.name+"/")
-            print()
-            print("File:")
-            for item in file_content:
-                print(item.name+"\t\t" +
-                      f"{item.inode.file_size} bytes\t\t{item.inode.mtime}")
-            print()
-        elif command_list[0] == "cd":
-            if len(command_list) < 2:
-                print("Usage: cd <directory_name>")
-                continue
-            fs.change_directory(command_list[1])
-        elif command_list[0] == "mkdir":
-            if len(command_list) < 2:
-                print("Usage: mkdir <directory_name>")
-                continue
-            fs.make_directory(command_list[1])
-        elif command_list[0] == "rmdir":
-            if len(command_list) < 2:
-                print("Usage: rmdir <directory_name>")
-                continue
-            fs.remove_directory(command_list[1])
-        elif command_list[0] == "exit":
+        try:
+            command = input()
+        except EOFError:
             break
-        elif command_list[0] == "pwd":
-            print(fs.get_current_path())
-        elif command_list[0] == "help":
-            print("Available commands:")
-            print("touch <filename> - Create a new file")
-            print("edit <filename> <data> - Write data to a file")
-            print("cat <filename> - Read a file")
-            print("rm <filename> - Delete a file")
-            print("ls - List files and directories in the current directory")
-            print("cd <directory_name> - Change to a directory")
-            print("mkdir <directory_name> - Create a new directory")
-            print("rmdir <directory_name> - Remove a directory")
-            print("pwd - Print the current working directory")
-            print("exit - Exit the file system")
-        else:
-            print("Unknown command: ", command_list[0], "Use 'help' for help")
+        command_list = parse_command(command)
+        if not command_list:
+            continue
+        if command_list[0] == "exit":
+            break
+        if execute_command(fs, command_list, sys.stdin.buffer) and command_list[0] == "import":
+            fs.save_to_disk(image)
+        fs.reap()
+    fs.save_to_disk(image)
+
+
+def run_batch(fs, script, image, timings=False, stop_on_error=False, stdin=None):
+    """非交互执行脚本中的所有命令, 所有命令作为一个事务, 结束后只保存一次镜像
+    stop_on_error为True时遇到失败的命令立即中止, 且不保存镜像
+    Returns:
+        int: 失败的命令数
+    """
+    failed = 0
+    start = time.perf_counter()
+    for line_number, command in enumerate(script, 1):
+        command_list = parse_command(command)
+        if command_list is None:
+            failed += 1
+            if stop_on_error:
+                print(f"Aborted at line {line_number}, image not saved", file=sys.stderr)
+                return failed
+            continue
+        if not command_list:
             continue
+        if command_list[0] == "exit":
+            break
+        command_start = time.perf_counter()
+        result = execute_command(fs, command_list, stdin)
+        if timings:
+            elapsed = (time.perf_counter() - command_start) * 1000
+            print(f"{elapsed:10.3f} ms\t{line_number}\t{command.strip()}", file=sys.stderr)
+        fs.reap()
+        if not result:
+            failed += 1
+            if stop_on_error:
+                print(f"Aborted at line {line_number}, image not saved", file=sys.stderr)
+                return failed
+    save_start = time.perf_counter()
+    fs.save_to_disk(image)
+    if timings:
+        now = time.perf_counter()
+        print(f"{(now - save_start) * 1000:10.3f} ms\t-\tsave {image}", file=sys.stderr)
+        print(f"{(now - start) * 1000:10.3f} ms\t-\ttotal", file=sys.stderr)
+    return failed
+
 
-    fs.save_to_disk("fs.pickle")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="File system command line")
+    parser.add_argument("--image", default="fs.pickle", help="image file to load and save")
+    parser.add_argument("--batch", metavar="SCRIPT",
+                        help="run commands from SCRIPT non-interactively, '-' reads from stdin")
+    parser.add_argument("--timings", action="store_true",
+                        help="report per-command timings on stderr in batch mode")
+    parser.add_argument("--stop-on-error", action="store_true",
+                        help="abort the batch without saving on the first failed command")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.image):
+        fs = load_from_disk(args.image)
+    else:
+        fs = FileSystem()
+    if args.batch is None:
+        run_interactive(fs, args.image)
+        return 0
+    if args.batch == "-":
+        failed = run_batch(fs, sys.stdin, args.image, args.timings, args.stop_on_error)
+    else:
+        with open(args.batch, "r", encoding="utf-8") as f:
+            failed = run_batch(fs, f, args.image, args.timings, args.stop_on_error, sys.stdin.buffer)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    # 通过模块名调用, 保证镜像中记录的类属于file_system_core而不是__main__
+    import file_system_core
+    sys.exit(file_system_core.main())
@@ -0,0 +1,242 @@
+import argparse
+import os
+import sys
+from collections import Counter, deque
+from itertools import chain, compress, repeat
+from operator import attrgetter, gt, lt
+
+from file_system_core import load_from_disk
+
+
+class FsckReport:
+    """一次检查的结果, 每一项都是待修复的问题列表
+    """
+
+    def __init__(self):
+        self.orphaned_blocks = []   # 位图中已占用但没有任何文件引用的块
+        self.unmarked_blocks = []   # 被文件引用但位图中为空闲的块
+        self.shared_blocks = {}     # 被多个文件引用的块, 块号 -> 引用它的文件路径
+        self.invalid_blocks = []    # (文件路径, 块号), 块号超出范围
+        self.size_errors = []       # (文件路径, 记录的大小, 实际大小)
+        self.tree_errors = []       # 目录树问题描述
+        self.usage_errors = []      # (目录路径, 记录的(大小, 文件数), 实际的(大小, 文件数))
+        self.used_size = (0, 0)     # (记录的已用空间, 实际的已用空间)
+        self.repaired = False
+
+    def ok(self):
+        return not (self.orphaned_blocks or self.unmarked_blocks or self.shared_blocks
+                    or self.invalid_blocks or self.size_errors or self.tree_errors or self.usage_errors
+                    or self.used_size[0] != self.used_size[1])
+
+    def summary(self):
+        lines = []
+        if self.orphaned_blocks:
+            lines.append(f"{len(self.orphaned_blocks)} orphaned blocks")
+        if self.unmarked_blocks:
+            lines.append(f"{len(self.unmarked_blocks)} referenced blocks marked free")
+        for block_index, paths in sorted(self.shared_blocks.items()):
+            lines.append(f"block {block_index} shared by {', '.join(paths)}")
+        for path, block_index in self.invalid_blocks:
+            lines.append(f"{path}: invalid block {block_index}")
+        for path, recorded, actual in self.size_errors:
+            lines.append(f"{path}: size {recorded} recorded, {actual} stored")
+        lines.extend(self.tree_errors)
+        for path, recorded, actual in self.usage_errors:
+            lines.append(f"{path}: usage {recorded[0]} bytes/{recorded[1]} files recorded, "
+                         f"{actual[0]} bytes/{actual[1]} files actual")
+        if self.used_size[0] != self.used_size[1]:
+            lines.append(f"used size {self.used_size[0]} recorded, {self.used_size[1]} actual")
+        if not lines:
+            lines.append("clean")
+        elif self.repaired:
+            lines.append("repaired")
+        return lines
+
+
+def count_references(block_lists):
+    """统计每个块被引用的次数
+    镜像最多只有file_block_nums个块引用, Counter在C层一次统计完毕, 比分发给多进程的开销还小
+    """
+    return Counter(chain.from_iterable(block_lists))
+
+
+def check_tree(fs, report, repair):
+    """检查目录树: 父指针, 同名项, 重复挂载, 当前目录是否可达
+    Returns:
+        list: [(路径, 文件)], 目录树中的所有文件
+    """
+    files = []
+    seen = set()
+    stack = [(fs.root, "")]
+    while stack:
+        directory, path = stack.pop()
+        for kind, children in (("file", directory.files), ("directory", directory.subdirectories)):
+            names = set()
+            for child in list(children):
+                child_path = path + "/" + child.name
+                if id(child) in seen:
+                    report.tree_errors.append(f"{child_path}: {kind} linked more than once")
+                    if repair:
+                        children.remove(child)
+                    continue
+                seen.add(id(child))
+                if child.parent is not directory:
+                    report.tree_errors.append(f"{child_path}: wrong parent")
+                    if repair:
+                        child.parent = directory
+                if child.name in names:
+                    report.tree_errors.append(f"{child_path}: duplicate {kind} name")
+                    if repair:
+                        suffix = 1
+                        while f"{child.name}~{suffix}" in names:
+                            suffix += 1
+                        child.name = f"{child.name}~{suffix}"
+                        child_path = path + "/" + child.name
+                names.add(child.name)
+                if kind == "file":
+                    files.append((child_path, child))
+                else:
+                    stack.append((child, child_path))
+    if fs.current_directory is not fs.root and id(fs.current_directory) not in seen:
+        report.tree_errors.append("current directory is not reachable from /")
+        if repair:
+            fs.current_directory = fs.root
+    return files
+
+
+def check_usage(fs, report, repair):
+    """检查每个目录缓存的递归大小和文件数
+    """
+    directories = []
+    stack = [(fs.root, "/")]
+    while stack:
+        directory, path = stack.pop()
+        directories.append((directory, path))
+        for subdirectory in directory.subdirectories:
+            stack.append((subdirectory, path.rstrip("/") + "/" + subdirectory.name))
+    actual = {}
+    for directory, path in reversed(directories):
+        size = sum(file.inode.file_size for file in directory.files)
+        count = len(directory.files)
+        for subdirectory in directory.subdirectories:
+            size += actual[id(subdirectory)][0]
+            count += actual[id(subdirectory)][1]
+        actual[id(directory)] = (size, count)
+        recorded = (directory.total_size, directory.total_files)
+        if recorded != (size, count):
+            report.usage_errors.append((path, recorded, (size, count)))
+            if repair:
+                directory.total_size, directory.total_files = size, count
+
+
+def trash_files(fs):
+    """回收站中尚未回收的文件, 它们的块仍然有效占用
+    """
+    files = []
+    stack = list(fs.trash)
+    while stack:
+        entry = stack.pop()
+        if entry.type == "file":
+            files.append(entry)
+        else:
+            stack.extend(entry.files)
+            stack.extend(entry.subdirectories)
+    return files
+
+
+def fsck(fs, repair=False):
+    """交叉检查位图, 文件块索引和目录树, repair为True时就地修复
+    Returns:
+        FsckReport: 检查结果
+    """
+    report = FsckReport()
+    files = check_tree(fs, report, repair)
+    block_nums = fs.file_block_nums
+
+    trashed = trash_files(fs)
+    files += [("<trash>/" + file.name, file) for file in trashed]
+    block_lists = [file.inode.file_blocks_index for _, file in files]
+    counts = count_references(block_lists)
+
+    # 位图比较: 用map/compress在C层逐字节比较, 避免Python级循环
+    referenced = bytearray(block_nums)
+    valid_indexes = [i for i in counts if 0 <= i < block_nums]
+    deque(map(referenced.__setitem__, valid_indexes, repeat(1)), maxlen=0)
+    report.orphaned_blocks = list(compress(range(block_nums), map(gt, fs.valid_blocks, referenced)))
+    report.unmarked_blocks = list(compress(range(block_nums), map(lt, fs.valid_blocks, referenced)))
+    shared = {i for i in valid_indexes if counts[i] > 1}
+    has_invalid = len(valid_indexes) != len(counts)
+    if repair:
+        # 先修正位图, 保证下面为共享块分配新块时不会拿到仍被引用的块
+        for block_index in report.orphaned_blocks:
+            fs.valid_blocks[block_index] = 0
+        for block_index in report.unmarked_blocks:
+            fs.valid_blocks[block_index] = 1
+
+    # 只有存在越界或共享块时才需要回到文件逐个定位
+    owners = {}
+    if shared or has_invalid:
+        for path, file in files:
+            kept = []
+            for block_index in file.inode.file_blocks_index:
+                if not 0 <= block_index < block_nums:
+                    report.invalid_blocks.append((path, block_index))
+                    continue
+                if block_index in shared:
+                    owners.setdefault(block_index, []).append(path)
+                    if repair and len(owners[block_index]) > 1:
+                        # 后来的引用者复制一份数据到新块
+                        new_index = fs.allocate_block()
+                        if new_index == -1:
+                            continue
+                        fs.space[new_index].write(bytearray(fs.space[block_index].read()))
+                        block_index = new_index
+                kept.append(block_index)
+            if repair:
+                file.inode.file_blocks_index = kept
+        report.shared_blocks = owners
+
+    # 回收站中的文件可能已被部分回收, 只计入记录的大小, 不检查块内容
+    actual_used = sum(file.inode.file_size for file in trashed)
+    space = fs.space
+    for path, file in files[:len(files) - len(trashed)]:
+        indexes = file.inode.file_blocks_index
+        if has_invalid and not repair:
+            indexes = [i for i in indexes if 0 <= i < block_nums]
+        stored = sum(map(len, map(attrgetter("data"), map(space.__getitem__, indexes))))
+        if stored != file.inode.file_size:
+            report.size_errors.append((path, file.inode.file_size, stored))
+            if repair:
+                file.inode.file_size = stored
+        actual_used += stored
+    report.used_size = (fs.used_size, actual_used)
+
+    # 文件大小修复后再核对目录统计
+    check_usage(fs, report, repair)
+
+    if repair and not report.ok():
+        fs.used_size = actual_used
+        fs.rebuild_search_index()
+        report.repaired = True
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check file system image consistency")
+    parser.add_argument("image", nargs="?", default="fs.pickle")
+    parser.add_argument("--repair", action="store_true", help="repair problems and save the image")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.image):
+        print("Image not found")
+        return 2
+    fs = load_from_disk(args.image)
+    report = fsck(fs, args.repair)
+    for line in report.summary():
+        print(line)
+    if report.repaired:
+        fs.save_to_disk(args.image)
+    return 0 if report.ok() or report.repaired else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
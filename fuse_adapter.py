@@ -0,0 +1,298 @@
+import errno
+import os
+import stat
+import sys
+import time
+from datetime import datetime
+
+from file_system_core import FileSystem, BLOCK_SIZE, load_from_disk
+
+try:
+    from fuse import FUSE, FuseOSError, Operations
+except ImportError:
+    # 未安装fusepy时仍可通过InProcessDriver在进程内使用
+    FUSE = None
+
+    class FuseOSError(OSError):
+        def __init__(self, errno_):
+            super().__init__(errno_, os.strerror(errno_))
+
+    class Operations:
+        pass
+
+ATTR_TIMEOUT = 1.0      # 属性缓存有效期(秒)
+MOVE_ERRORS = {1: errno.ENOENT, 3: errno.ENOTEMPTY, 4: errno.EINVAL, 5: errno.EINVAL, 6: errno.EDQUOT}
+
+
+class FileSystemOperations(Operations):
+    """以fusepy的Operations接口暴露FileSystem, 所有路径均为挂载点内的绝对路径
+    读写按偏移只访问涉及的块, 路径解析结果和文件属性都有缓存, 命名空间变化时失效
+    """
+
+    def __init__(self, fs: FileSystem, attr_timeout=ATTR_TIMEOUT):
+        self.fs = fs
+        self.attr_timeout = attr_timeout
+        self.entries = {}       # 路径 -> 文件或目录
+        self.attrs = {}         # 路径 -> (属性, 过期时间)
+        self.handles = {}       # 文件句柄 -> 文件
+        self.dirty = set()      # 写入后尚未刷新内容索引的文件
+        self.next_fh = 1
+
+    def _lookup(self, path):
+        entry = self.entries.get(path)
+        if entry is None:
+            entry = self.fs.resolve_path(path)
+            if entry is None:
+                raise FuseOSError(errno.ENOENT)
+            self.entries[path] = entry
+        return entry
+
+    def _file(self, path, fh=None):
+        file = self.handles.get(fh) if fh else None
+        if file is None:
+            file = self._lookup(path)
+        if file.type != "file":
+            raise FuseOSError(errno.EISDIR)
+        return file
+
+    def _directory(self, path):
+        directory = self._lookup(path)
+        if directory.type != "directory":
+            raise FuseOSError(errno.ENOTDIR)
+        return directory
+
+    def _invalidate(self, path=None):
+        """path为None时清空全部缓存, 否则只使path及其所在目录的属性失效
+        """
+        if path is None:
+            self.entries.clear()
+            self.attrs.clear()
+            return
+        self.attrs.pop(path, None)
+        self.attrs.pop(os.path.dirname(path), None)
+
+    def _open_handle(self, file):
+        fh = self.next_fh
+        self.next_fh += 1
+        self.handles[fh] = file
+        # 删除或被覆盖的文件在最后一个句柄关闭前不能被回收, 否则经句柄写入的块会泄漏
+        self.fs.pinned.add(file)
+        return fh
+
+    def getattr(self, path, fh=None):
+        cached = self.attrs.get(path)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        entry = self._lookup(path)
+        if entry.type == "directory":
+            attrs = dict(st_mode=stat.S_IFDIR | 0o755, st_nlink=2 + len(entry.subdirectories),
+                         st_size=BLOCK_SIZE, st_blocks=0)
+            times = entry
+        else:
+            times = entry.inode
+            attrs = dict(st_mode=stat.S_IFREG | 0o644, st_nlink=1, st_size=times.file_size,
+                         st_blocks=len(times.file_blocks_index) * (BLOCK_SIZE // 512))
+        ctime, mtime, atime = times.ctime.timestamp(), times.mtime.timestamp(), times.atime.timestamp()
+        attrs.update(st_ino=self.fs.get_ino(entry), st_uid=os.getuid(), st_gid=os.getgid(),
+                     st_blksize=BLOCK_SIZE, st_ctime=ctime, st_mtime=mtime, st_atime=atime)
+        self.attrs[path] = (attrs, time.monotonic() + self.attr_timeout)
+        return attrs
+
+    def readdir(self, path, fh=None):
+        directory = self._directory(path)
+        return [".", ".."] + [d.name for d in directory.subdirectories] + [f.name for f in directory.files]
+
+    def statfs(self, path):
+        free = self.fs.get_valid_block_nums()
+        return dict(f_bsize=BLOCK_SIZE, f_frsize=BLOCK_SIZE, f_blocks=self.fs.file_block_nums,
+                    f_bfree=free, f_bavail=free, f_namemax=255)
+
+    def open(self, path, flags):
+        file = self._file(path)
+        if flags & os.O_TRUNC:
+            self.truncate(path, 0)
+        return self._open_handle(file)
+
+    def create(self, path, mode, fi=None):
+        if not self.fs.create_file(path):
+            raise FuseOSError(errno.EEXIST if self.fs.resolve_path(path) else errno.ENOENT)
+        self._invalidate(path)
+        return self._open_handle(self._file(path))
+
+    def read(self, path, size, offset, fh=None):
+        return self._file(path, fh).read_range(offset, size, self.fs)
+
+    def _resize_error(self, file, length):
+        """扩展失败时区分配额不足和空间不足
+        """
+        if file.parent and not file.parent.check_quota(length - file.inode.file_size):
+            return errno.EDQUOT
+        return errno.ENOSPC
+
+    def write(self, path, data, offset, fh=None):
+        file = self._file(path, fh)
+        if not file.write_range(data, offset, self.fs):
+            raise FuseOSError(self._resize_error(file, offset + len(data)))
+        self.dirty.add(file)
+        self.attrs.pop(path, None)
+        return len(data)
+
+    def truncate(self, path, length, fh=None):
+        file = self._file(path, fh)
+        if not file.resize(length, self.fs):
+            raise FuseOSError(self._resize_error(file, length))
+        self.dirty.add(file)
+        self.attrs.pop(path, None)
+
+    def flush(self, path, fh=None):
+        file = self.handles.get(fh)
+        if file in self.dirty:
+            self.dirty.discard(file)
+            self.fs.refresh_content_index(file)
+
+    def release(self, path, fh=None):
+        self.flush(path, fh)
+        file = self.handles.pop(fh, None)
+        if file is not None and file not in self.handles.values():
+            self.fs.pinned.discard(file)
+        # 与图形界面和命令行一样, 在每次操作结束后增量回收回收站
+        self.fs.reap()
+
+    def fsync(self, path, datasync, fh=None):
+        self.flush(path, fh)
+
+    def utimens(self, path, times=None):
+        entry = self._lookup(path)
+        target = entry.inode if entry.type == "file" else entry
+        atime, mtime = times if times else (time.time(), time.time())
+        target.atime = datetime.fromtimestamp(atime)
+        target.mtime = datetime.fromtimestamp(mtime)
+        self.attrs.pop(path, None)
+
+    def chmod(self, path, mode):
+        # 文件系统不保存权限位, 接受调用以兼容cp -p和rsync
+        self._lookup(path)
+
+    def chown(self, path, uid, gid):
+        self._lookup(path)
+
+    def mkdir(self, path, mode):
+        if not self.fs.make_directory(path):
+            raise FuseOSError(errno.EEXIST if self.fs.resolve_path(path) else errno.ENOENT)
+        self._invalidate(path)
+
+    def rmdir(self, path):
+        directory = self._directory(path)
+        if directory.files or directory.subdirectories:
+            raise FuseOSError(errno.ENOTEMPTY)
+        if not self.fs.remove_directory(path):
+            raise FuseOSError(errno.EBUSY)
+        self._invalidate()
+        self.fs.reap()
+
+    def unlink(self, path):
+        self._file(path)
+        self.fs.delete_file(path)
+        self._invalidate()
+        self.fs.reap()
+
+    def rename(self, old, new):
+        result, err = self.fs.move(old, new)
+        if not result:
+            if err == 7:
+                # 目录覆盖文件为ENOTDIR, 文件覆盖目录为EISDIR
+                raise FuseOSError(errno.ENOTDIR if self._lookup(old).type == "directory" else errno.EISDIR)
+            raise FuseOSError(MOVE_ERRORS.get(err, errno.EINVAL))
+        self._invalidate()
+
+
+class InProcessDriver:
+    """在进程内模拟内核对FileSystemOperations的调用顺序, 无需真正挂载即可使用和测试适配器
+    """
+
+    def __init__(self, operations: FileSystemOperations):
+        self.operations = operations
+
+    def stat(self, path):
+        return self.operations.getattr(path)
+
+    def listdir(self, path):
+        return [name for name in self.operations.readdir(path) if name not in (".", "..")]
+
+    def mkdir(self, path):
+        self.operations.mkdir(path, 0o755)
+
+    def rmdir(self, path):
+        self.operations.rmdir(path)
+
+    def unlink(self, path):
+        self.operations.unlink(path)
+
+    def rename(self, old, new):
+        self.operations.rename(old, new)
+
+    def truncate(self, path, length):
+        self.operations.truncate(path, length)
+
+    def read_file(self, path, chunk_size=128*1024):
+        fh = self.operations.open(path, os.O_RDONLY)
+        try:
+            chunks = []
+            offset = 0
+            while True:
+                chunk = self.operations.read(path, chunk_size, offset, fh)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                offset += len(chunk)
+            return b"".join(chunks)
+        finally:
+            self.operations.release(path, fh)
+
+    def write_file(self, path, data, chunk_size=128*1024):
+        """像cp一样创建或截断文件后按chunk_size顺序写入
+        """
+        try:
+            self.operations.getattr(path)
+            fh = self.operations.open(path, os.O_WRONLY | os.O_TRUNC)
+        except FuseOSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            fh = self.operations.create(path, 0o644)
+        try:
+            view = memoryview(data)
+            for offset in range(0, len(data), chunk_size):
+                self.operations.write(path, view[offset:offset + chunk_size], offset, fh)
+        finally:
+            self.operations.release(path, fh)
+
+    def copy_in(self, host_path, path, chunk_size=128*1024):
+        with open(host_path, "rb") as f:
+            self.write_file(path, f.read(), chunk_size)
+
+    def copy_out(self, path, host_path, chunk_size=128*1024):
+        with open(host_path, "wb") as f:
+            f.write(self.read_file(path, chunk_size))
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Mount a file system image with FUSE")
+    parser.add_argument("mountpoint")
+    parser.add_argument("--image", default="fs.pickle")
+    args = parser.parse_args(argv)
+    if FUSE is None:
+        print("fusepy is not installed")
+        return 1
+    fs = load_from_disk(args.image) if os.path.exists(args.image) else FileSystem()
+    try:
+        # 前台单线程运行, 卸载后保存镜像
+        # use_ino让内核使用getattr返回的st_ino, 否则硬链接检测和find/du等工具会看到合成的inode号
+        FUSE(FileSystemOperations(fs), args.mountpoint, foreground=True, nothreads=True, use_ino=True)
+    finally:
+        fs.save_to_disk(args.image)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import bisect
+import fnmatch
+import re
+
+GLOB_CHARS = "*?["
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class NameIndex:
+    """全局名字索引, 名字有序存放, 前缀查询与通配符查询都只需二分定位后顺序扫描
+    """
+
+    def __init__(self):
+        self.entries = {}   # 名字 -> 同名的文件和目录集合
+        self.names = []     # 有序的名字列表
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.entries.values())
+
+    def add(self, entry):
+        bucket = self.entries.get(entry.name)
+        if bucket is None:
+            self.entries[entry.name] = {entry}
+            bisect.insort(self.names, entry.name)
+        else:
+            bucket.add(entry)
+
+    def extend(self, entries):
+        """批量加入条目, 名字只在最后排序一次, 用于重建索引和批量导入
+        """
+        for entry in entries:
+            bucket = self.entries.get(entry.name)
+            if bucket is None:
+                self.entries[entry.name] = {entry}
+            else:
+                bucket.add(entry)
+        if len(self.entries) != len(self.names):
+            self.names = sorted(self.entries)
+
+    def remove(self, entry, name=None):
+        if name is None:
+            name = entry.name
+        bucket = self.entries.get(name)
+        if bucket is None or entry not in bucket:
+            return
+        bucket.discard(entry)
+        if not bucket:
+            del self.entries[name]
+            del self.names[bisect.bisect_left(self.names, name)]
+
+    def rename(self, entry, old_name):
+        self.remove(entry, old_name)
+        self.add(entry)
+
+    def prefix(self, prefix):
+        """返回名字以prefix开头的所有条目
+        """
+        i = bisect.bisect_left(self.names, prefix)
+        while i < len(self.names) and self.names[i].startswith(prefix):
+            yield from self.entries[self.names[i]]
+            i += 1
+
+    def glob(self, pattern):
+        """返回名字匹配通配符pattern的所有条目, pattern的字面前缀用于缩小扫描范围
+        """
+        literal = pattern
+        for i, char in enumerate(pattern):
+            if char in GLOB_CHARS:
+                literal = pattern[:i]
+                break
+        regex = re.compile(fnmatch.translate(pattern))
+        i = bisect.bisect_left(self.names, literal)
+        while i < len(self.names) and self.names[i].startswith(literal):
+            if regex.match(self.names[i]):
+                yield from self.entries[self.names[i]]
+            i += 1
+
+    def search(self, pattern):
+        if any(char in pattern for char in GLOB_CHARS):
+            return self.glob(pattern)
+        return self.prefix(pattern)
+
+
+class ContentIndex:
+    """文件内容倒排索引, 词 -> 包含该词的文件集合
+    """
+
+    def __init__(self):
+        self.postings = {}  # 词 -> 文件集合
+        self.tokens = {}    # 文件 -> 文件包含的词, 用于更新时撤销旧的倒排项
+
+    def __len__(self):
+        return len(self.tokens)
+
+    @staticmethod
+    def tokenize(data):
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode("utf-8", errors="ignore")
+        return {token.lower() for token in TOKEN_PATTERN.findall(data)}
+
+    def update(self, file, data):
+        self.remove(file)
+        tokens = self.tokenize(data)
+        if not tokens:
+            return
+        self.tokens[file] = tokens
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is None:
+                self.postings[token] = {file}
+            else:
+                posting.add(file)
+
+    def remove(self, file):
+        tokens = self.tokens.pop(file, None)
+        if tokens is None:
+            return
+        for token in tokens:
+            posting = self.postings[token]
+            posting.discard(file)
+            if not posting:
+                del self.postings[token]
+
+    def search(self, query):
+        """返回同时包含query中所有词的文件
+        """
+        tokens = self.tokenize(query)
+        if not tokens:
+            return set()
+        postings = sorted((self.postings.get(token, set()) for token in tokens), key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            result &= posting
+            if not result:
+                break
+        return result
@@ -0,0 +1,53 @@
+import pytest
+
+from file_system_core import FileSystem, execute_command
+from fsck import fsck
+
+
+@pytest.fixture
+def fs():
+    fs = FileSystem()
+    execute_command(fs, ["mkdir", "/x"])
+    execute_command(fs, ["quota", "/x", "1K"])
+    return fs
+
+
+@pytest.fixture
+def big(tmp_path):
+    path = tmp_path / "big"
+    path.write_bytes(b"b" * 10240)
+    return str(path)
+
+
+def test_write_creates_file(fs, tmp_path):
+    path = tmp_path / "small"
+    path.write_bytes(b"hello")
+    assert execute_command(fs, ["write", "/x/small", str(path)])
+    assert fs.read_file("/x/small") == b"hello"
+
+
+def test_failed_write_does_not_leave_new_file(fs, big, capsys):
+    assert not execute_command(fs, ["write", "/x/big", big])
+    assert "Quota exceeded" in capsys.readouterr().out
+    assert fs.resolve_path("/x/big") is None
+    fs.reap(None)
+    assert fsck(fs).ok()
+
+
+def test_failed_write_keeps_existing_file(fs, big):
+    assert execute_command(fs, ["edit", "/x/keep", "data"]) is False
+    execute_command(fs, ["touch", "/x/keep"])
+    assert execute_command(fs, ["edit", "/x/keep", "data"])
+    assert not execute_command(fs, ["write", "/x/keep", big])
+    assert fs.read_file("/x/keep") == b"data"
+
+
+def test_edit_reports_actual_failure(fs, capsys):
+    assert not execute_command(fs, ["edit", "/x/missing", "data"])
+    assert "File not found" in capsys.readouterr().out
+    execute_command(fs, ["touch", "/x/f"])
+    capsys.readouterr()
+    assert not execute_command(fs, ["edit", "/x/f", "y" * 2000])
+    out = capsys.readouterr().out
+    assert "Quota exceeded" in out
+    assert "File not found" not in out
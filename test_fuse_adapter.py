@@ -0,0 +1,113 @@
+import errno
+
+import pytest
+
+from file_system_core import FileSystem, BLOCK_SIZE
+from fsck import fsck
+from fuse_adapter import FileSystemOperations, FuseOSError, InProcessDriver
+
+
+@pytest.fixture
+def fs():
+    return FileSystem()
+
+
+@pytest.fixture
+def driver(fs):
+    return InProcessDriver(FileSystemOperations(fs))
+
+
+def assert_clean(fs):
+    fs.reap(None)
+    report = fsck(fs)
+    assert report.ok(), report.summary()
+
+
+def test_round_trip(fs, driver):
+    data = bytes(range(256)) * (3 * BLOCK_SIZE // 256) + b"tail"
+    driver.mkdir("/docs")
+    driver.write_file("/docs/a.bin", data, chunk_size=1000)
+    assert driver.read_file("/docs/a.bin") == data
+    assert driver.stat("/docs/a.bin")["st_size"] == len(data)
+
+    driver.truncate("/docs/a.bin", BLOCK_SIZE + 10)
+    assert driver.read_file("/docs/a.bin") == data[:BLOCK_SIZE + 10]
+    driver.truncate("/docs/a.bin", 2 * BLOCK_SIZE)
+    assert driver.read_file("/docs/a.bin") == data[:BLOCK_SIZE + 10] + bytes(BLOCK_SIZE - 10)
+
+    driver.mkdir("/archive")
+    driver.rename("/docs/a.bin", "/archive/b.bin")
+    assert driver.listdir("/docs") == []
+    assert driver.listdir("/archive") == ["b.bin"]
+    assert driver.read_file("/archive/b.bin") == data[:BLOCK_SIZE + 10] + bytes(BLOCK_SIZE - 10)
+    assert fs.get_dir_usage(fs.resolve_path("/archive")) == (2 * BLOCK_SIZE, 1)
+    assert fs.get_dir_usage(fs.root) == (2 * BLOCK_SIZE, 1)
+
+    driver.write_file("/archive/b.bin", b"short")
+    assert driver.read_file("/archive/b.bin") == b"short"
+    assert_clean(fs)
+
+    driver.unlink("/archive/b.bin")
+    driver.rmdir("/docs")
+    assert_clean(fs)
+    assert fs.used_size == 0
+    assert fs.get_valid_block_nums() == fs.file_block_nums
+
+
+def test_unlinked_file_stays_writable_until_release(fs):
+    operations = FileSystemOperations(fs)
+    fh = operations.create("/a", 0o644)
+    operations.write("/a", b"x" * 3 * BLOCK_SIZE, 0, fh)
+    operations.unlink("/a")
+    fs.reap(None)
+    operations.write("/a", b"y" * BLOCK_SIZE, 3 * BLOCK_SIZE, fh)
+    assert operations.read("/a", 4, 3 * BLOCK_SIZE, fh) == b"yyyy"
+    assert fsck(fs).ok()
+    operations.release("/a", fh)
+    assert_clean(fs)
+    assert fs.get_valid_block_nums() == fs.file_block_nums
+
+
+def test_errors(fs, driver):
+    driver.mkdir("/q")
+    assert fs.set_quota("/q", BLOCK_SIZE)
+    with pytest.raises(FuseOSError) as e:
+        driver.write_file("/q/f", b"x" * (BLOCK_SIZE + 1))
+    assert e.value.errno == errno.EDQUOT
+
+    driver.write_file("/f", b"x")
+    driver.mkdir("/d")
+    driver.write_file("/d/g", b"y")
+    for old, new, code in (("/f", "/q", errno.EISDIR), ("/q", "/f", errno.ENOTDIR),
+                           ("/q", "/d", errno.ENOTEMPTY), ("/missing", "/x", errno.ENOENT)):
+        with pytest.raises(FuseOSError) as e:
+            driver.rename(old, new)
+        assert e.value.errno == code
+    assert_clean(fs)
+
+
+def test_rename_over_current_directory(fs, driver):
+    driver.mkdir("/a")
+    driver.mkdir("/b")
+    fs.change_directory("/b")
+    driver.rename("/a", "/b")
+    assert fs.current_directory is fs.root
+    assert fs.get_current_path() == "/"
+    assert driver.listdir("/") == ["b"]
+    assert_clean(fs)
+
+
+def test_rename_over_file_checks_net_quota(fs, driver):
+    driver.mkdir("/q")
+    driver.write_file("/q/data", b"x" * 900)
+    assert fs.set_quota("/q", 1000)
+    # 先写临时文件再改名覆盖, 净增量为0
+    driver.write_file("/tmp", b"y" * 900)
+    driver.rename("/tmp", "/q/data")
+    assert driver.read_file("/q/data") == b"y" * 900
+    driver.write_file("/tmp", b"z" * 1001)
+    with pytest.raises(FuseOSError) as e:
+        driver.rename("/tmp", "/q/data")
+    assert e.value.errno == errno.EDQUOT
+    assert driver.read_file("/q/data") == b"y" * 900
+    assert_clean(fs)
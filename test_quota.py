@@ -0,0 +1,160 @@
+import pytest
+
+from file_system_core import FileSystem, execute_command, parse_size
+from fsck import fsck
+
+
+@pytest.fixture
+def fs():
+    return FileSystem()
+
+
+@pytest.fixture
+def host(tmp_path):
+    root = tmp_path / "host"
+    (root / "sub").mkdir(parents=True)
+    (root / "a.txt").write_bytes(b"a" * 6)
+    (root / "sub" / "b.txt").write_bytes(b"b" * 10000)
+    return root
+
+
+def test_import_checks_quota_on_target(fs, host):
+    fs.make_directory("host")
+    fs.set_quota("/host", 100)
+    assert fs.import_from_host(str(host)) == (False, 0)
+    assert fs.get_dir_usage(fs.resolve_path("/host")) == (0, 0)
+    assert fsck(fs).ok()
+
+
+def test_import_checks_quota_on_existing_subdirectory(fs, host):
+    fs.make_directory("host")
+    fs.make_directory("host/sub")
+    fs.set_quota("/host/sub", 9999)
+    assert fs.import_from_host(str(host)) == (False, 0)
+    assert fs.resolve_path("/host/a.txt") is None
+    fs.set_quota("/host/sub", 10000)
+    assert fs.import_from_host(str(host)) == (True, 2)
+    assert fs.get_dir_usage(fs.resolve_path("/host")) == (10006, 2)
+
+
+def test_import_counts_overwritten_files(fs, host):
+    assert fs.import_from_host(str(host)) == (True, 2)
+    # 重新导入只覆盖同名文件, 大小不变, 不应因配额已满而失败
+    fs.set_quota("/host", 10006)
+    assert fs.import_from_host(str(host)) == (True, 2)
+    (host / "a.txt").write_bytes(b"a" * 7)
+    assert fs.import_from_host(str(host)) == (False, 0)
+    assert fs.get_dir_usage(fs.resolve_path("/host")) == (10006, 2)
+    assert fsck(fs).ok()
+
+
+def test_import_checks_quota_on_current_directory(fs, host):
+    fs.make_directory("box")
+    fs.set_quota("/box", 10005)
+    fs.change_directory("box")
+    assert fs.import_from_host(str(host)) == (False, 0)
+    assert fs.resolve_path("/box/host") is None
+
+
+@pytest.mark.parametrize("text, size", [("4096", 4096), ("10K", 10240), ("1.5MB", 1572864), ("0", 0)])
+def test_parse_size(text, size):
+    assert parse_size(text) == size
+
+
+@pytest.mark.parametrize("text", ["inf", "-inf", "nan", "1e400", "1e400K", "-5", "-1K", "10X", "abc", ""])
+def test_parse_size_rejects(text):
+    assert parse_size(text) is None
+
+
+def test_quota_command_rejects_invalid_sizes(fs):
+    fs.make_directory("d")
+    for size in ("inf", "1e400", "-5"):
+        assert not execute_command(fs, ["quota", "/d", size])
+    assert fs.resolve_path("/d").quota is None
+
+
+@pytest.fixture
+def limited(fs):
+    fs.make_directory("q")
+    fs.make_directory("q/inner")
+    fs.set_quota("/q", 1000)
+    return fs
+
+
+def usage(fs, path):
+    return fs.get_dir_usage(fs.resolve_path(path))
+
+
+def test_write_respects_quota_of_ancestors(limited):
+    fs = limited
+    fs.create_file("q/inner/a")
+    assert fs.write_file("q/inner/a", bytearray(1000))
+    assert usage(fs, "/q") == (1000, 1)
+    assert usage(fs, "/") == (1000, 1)
+    fs.create_file("q/b")
+    assert not fs.write_file("q/b", bytearray(1))
+    # 覆盖写入按差值检查
+    assert fs.write_file("q/inner/a", bytearray(999))
+    assert fs.write_file("q/b", bytearray(1))
+    assert not fs.write_file("q/inner/a", bytearray(1000))
+    assert fs.read_file("q/inner/a") == bytearray(999)
+    assert fsck(fs).ok()
+
+
+def test_resize_respects_quota(limited):
+    fs = limited
+    fs.create_file("q/a")
+    file = fs.resolve_path("q/a")
+    assert file.resize(1000, fs)
+    assert not file.resize(1001, fs)
+    assert not file.write_range(b"x", 1000, fs)
+    assert file.resize(10, fs)
+    assert file.write_range(b"x" * 990, 10, fs)
+    assert usage(fs, "/q") == (1000, 1)
+    assert fs.used_size == 1000
+    assert fsck(fs).ok()
+
+
+def test_move_respects_quota(limited):
+    fs = limited
+    fs.create_file("a")
+    fs.write_file("a", bytearray(600))
+    fs.make_directory("d")
+    fs.create_file("d/b")
+    fs.write_file("d/b", bytearray(600))
+    assert fs.move("/a", "/q/a") == (True, 0)
+    assert usage(fs, "/q") == (600, 1)
+    assert fs.move("/d", "/q/inner/d") == (False, 6)
+    assert fs.resolve_path("/d/b") is not None
+    assert usage(fs, "/d") == (600, 1)
+    # 在配额目录内部移动不改变总量
+    assert fs.move("/q/a", "/q/inner/a") == (True, 0)
+    assert usage(fs, "/q/inner") == (600, 1)
+    assert usage(fs, "/") == (1200, 2)
+    assert fsck(fs).ok()
+
+
+def test_usage_follows_delete_and_remove(limited):
+    fs = limited
+    fs.create_file("q/inner/a")
+    fs.write_file("q/inner/a", bytearray(500))
+    fs.create_file("q/b")
+    fs.write_file("q/b", bytearray(300))
+    fs.delete_file("q/b")
+    assert usage(fs, "/q") == (500, 1)
+    fs.remove_directory("/q/inner")
+    assert usage(fs, "/q") == (0, 0)
+    assert usage(fs, "/") == (0, 0)
+    fs.reap(None)
+    assert fs.used_size == 0
+    assert fsck(fs).ok()
+
+
+def test_clearing_quota_allows_growth(limited):
+    fs = limited
+    fs.create_file("q/a")
+    assert not fs.write_file("q/a", bytearray(2000))
+    assert execute_command(fs, ["quota", "/q", "none"])
+    assert fs.write_file("q/a", bytearray(2000))
+    assert execute_command(fs, ["quota", "/q", "1K"])
+    assert fs.resolve_path("/q").quota == 1024
@@ -0,0 +1,105 @@
+import pytest
+
+from file_system_core import FileSystem
+from search_index import NameIndex
+
+
+@pytest.fixture
+def fs():
+    fs = FileSystem()
+    fs.make_directory("docs")
+    fs.make_directory("docs/old")
+    for path in ("docs/report.txt", "docs/old/report.txt", "readme.md"):
+        fs.create_file(path)
+    return fs
+
+
+def paths(results):
+    return [path for path, _ in results]
+
+
+def test_prefix_and_glob(fs):
+    assert paths(fs.search("rep")) == ["/docs/old/report.txt", "/docs/report.txt"]
+    assert paths(fs.search("*.md")) == ["/readme.md"]
+    assert paths(fs.search("r*")) == ["/readme.md", "/docs/old/report.txt", "/docs/report.txt"]
+    assert paths(fs.search("missing")) == []
+
+
+def test_results_ordered_by_name_then_path_and_limited(fs):
+    assert paths(fs.search("*")) == ["/docs", "/docs/old", "/readme.md",
+                                     "/docs/old/report.txt", "/docs/report.txt"]
+    assert paths(fs.search("*", 3)) == ["/docs", "/docs/old", "/readme.md"]
+    assert paths(fs.search("re", 2)) == ["/readme.md", "/docs/old/report.txt"]
+
+
+def test_index_follows_create_rename_and_move(fs):
+    fs.create_file("notes")
+    assert paths(fs.search("notes")) == ["/notes"]
+    assert fs.rename_file("notes", "todo") == (True, 0)
+    assert fs.search("notes") == []
+    assert paths(fs.search("todo")) == ["/todo"]
+    assert fs.rename_directory("docs", "papers") == (True, 0)
+    assert paths(fs.search("papers")) == ["/papers"]
+    assert paths(fs.search("report")) == ["/papers/old/report.txt", "/papers/report.txt"]
+    assert fs.move("/todo", "/papers/old/done") == (True, 0)
+    assert paths(fs.search("done")) == ["/papers/old/done"]
+    assert fs.search("todo") == []
+
+
+def test_move_over_file_drops_replaced_entry(fs):
+    assert fs.move("/readme.md", "/docs/report.txt") == (True, 0)
+    assert paths(fs.search("re")) == ["/docs/old/report.txt", "/docs/report.txt"]
+    fs.reap(None)
+    assert len(fs.name_index) == 4
+
+
+def test_deleted_entries_are_hidden_then_dropped(fs):
+    fs.delete_file("readme.md")
+    assert fs.search("readme") == []
+    fs.remove_directory("/docs")
+    assert fs.search("*") == []
+    assert len(fs.name_index) > 0
+    fs.reap(None)
+    assert len(fs.name_index) == 0
+    assert fs.name_index.names == []
+
+
+def test_content_index_follows_writes_and_reap(fs):
+    fs.enable_content_index()
+    fs.write_file("readme.md", bytearray(b"Hello quota world"))
+    fs.write_file("docs/report.txt", bytearray(b"hello trash"))
+    assert paths(fs.search_content("hello")) == ["/readme.md", "/docs/report.txt"]
+    assert paths(fs.search_content("HELLO world")) == ["/readme.md"]
+    fs.write_file("readme.md", bytearray(b"bye"))
+    assert paths(fs.search_content("hello")) == ["/docs/report.txt"]
+    fs.delete_file("docs/report.txt")
+    assert fs.search_content("hello") == []
+    fs.reap(None)
+    assert len(fs.content_index) == 1
+
+
+def test_rebuild_matches_incremental_index(fs):
+    fs.rename_file("readme.md", "zz")
+    fs.move("/docs/old", "/old")
+    names, entries = list(fs.name_index.names), dict(fs.name_index.entries)
+    fs.rebuild_search_index()
+    assert fs.name_index.names == names
+    assert fs.name_index.entries == entries
+
+
+def test_extend_merges_into_existing_index():
+    class Entry:
+        def __init__(self, name):
+            self.name = name
+
+    index = NameIndex()
+    first = Entry("b")
+    index.add(first)
+    extra = [Entry("c"), Entry("a"), Entry("b")]
+    index.extend(extra)
+    assert index.names == ["a", "b", "c"]
+    assert len(index) == 4
+    assert index.entries["b"] == {first, extra[2]}
+    index.remove(first)
+    index.remove(extra[2])
+    assert index.names == ["a", "c"]
@@ -0,0 +1,97 @@
+import pytest
+
+from file_system_core import FileSystem, BLOCK_SIZE
+from fsck import fsck
+
+
+@pytest.fixture
+def fs():
+    return FileSystem()
+
+
+def free_blocks(fs):
+    return fs.get_valid_block_nums()
+
+
+def test_delete_file_is_reclaimed_incrementally(fs):
+    fs.create_file("a")
+    fs.write_file("a", bytearray(b"x" * 10 * BLOCK_SIZE))
+    used = fs.file_block_nums - free_blocks(fs)
+    fs.delete_file("a")
+    assert fs.search("a") == []
+    assert fsck(fs).ok()
+    assert not fs.reap(4)
+    assert fs.file_block_nums - free_blocks(fs) == used - 4
+    assert fsck(fs).ok()
+    assert fs.reap(None)
+    assert free_blocks(fs) == fs.file_block_nums
+    assert fs.used_size == 0
+    assert len(fs.name_index) == 0
+
+
+def test_removed_directory_is_reclaimed(fs):
+    fs.make_directory("d")
+    fs.make_directory("d/e")
+    for path in ("d/a", "d/e/b"):
+        fs.create_file(path)
+        fs.write_file(path, bytearray(b"y" * 3 * BLOCK_SIZE))
+    assert fs.remove_directory("/d")
+    assert fs.search("") == []
+    assert fs.get_dir_usage(fs.root) == (0, 0)
+    assert fsck(fs).ok()
+    fs.reap(None)
+    assert not fs.trash
+    assert free_blocks(fs) == fs.file_block_nums
+    assert len(fs.name_index) == 0
+    assert fsck(fs).ok()
+
+
+def test_reap_work_is_bounded_for_empty_files(fs):
+    fs.make_directory("d")
+    for i in range(1000):
+        fs.create_file(f"d/f{i}")
+    fs.remove_directory("/d")
+    remaining = len(fs.name_index)
+    calls = 0
+    while not fs.reap(10):
+        calls += 1
+        assert remaining - len(fs.name_index) <= 10
+        remaining = len(fs.name_index)
+    assert calls >= 100
+    assert len(fs.name_index) == 0
+
+
+def test_reap_frees_at_most_budget_blocks(fs):
+    for name in ("a", "b"):
+        fs.create_file(name)
+        fs.write_file(name, bytearray(b"z" * 5 * BLOCK_SIZE))
+        fs.delete_file(name)
+    free = free_blocks(fs)
+    while not fs.reap(3):
+        assert free_blocks(fs) - free <= 3
+        free = free_blocks(fs)
+    assert free_blocks(fs) == fs.file_block_nums
+
+
+def test_write_reclaims_trash_when_space_runs_out(fs):
+    fs.create_file("big")
+    size = (fs.file_block_nums - 2) * BLOCK_SIZE
+    assert fs.write_file("big", bytearray(size))
+    fs.delete_file("big")
+    fs.create_file("again")
+    assert fs.write_file("again", bytearray(size))
+    assert fsck(fs).ok()
+
+
+def test_pinned_file_is_not_reclaimed(fs):
+    fs.create_file("a")
+    fs.write_file("a", bytearray(b"x" * BLOCK_SIZE))
+    file = fs.resolve_path("a")
+    fs.pinned.add(file)
+    fs.delete_file("a")
+    assert fs.reap(None)
+    assert list(fs.trash) == [file]
+    fs.pinned.discard(file)
+    fs.reap(None)
+    assert not fs.trash
+    assert free_blocks(fs) == fs.file_block_nums